@@ -0,0 +1,106 @@
+"""
+Compares the route trie of 'silence.server.endpoint' against the previous
+RoutePattern dict lookup (copied below, as it only supported one integer
+parameter at the end of the route) with a large number of routes.
+
+    python benchmarks/bench_router.py [--tables N] [--lookups N]
+"""
+
+from silence.server.endpoint import HttpMethod, RouteTrie
+
+from typing import Dict, List, Optional, Tuple
+
+import argparse
+import random
+import time
+
+from msgspec import Struct, field
+
+
+class RoutePattern(Struct, forbid_unknown_fields=True, omit_defaults=True):
+    url_parts: Tuple[str, ...] = field(default_factory=tuple)
+    method: HttpMethod = field(default=HttpMethod.GET)
+    parameterized: bool = field(default=False)
+
+    def __hash__(self) -> int:
+        return hash((self.url_parts, self.method, self.parameterized))
+
+
+class LegacyRouter:
+    def __init__(self):
+        self.static: Dict[RoutePattern, str] = dict()
+        self.parameterized: Dict[RoutePattern, str] = dict()
+
+    def insert(self, route: str, method: HttpMethod, name: str):
+        parts = tuple(part.casefold() for part in route.split("/") if part != "")
+        if parts and "$" in parts[-1]:
+            self.parameterized[RoutePattern(parts[:-1], method, True)] = name
+        else:
+            self.static[RoutePattern(parts, method, False)] = name
+
+    def match(self, route: str, method: HttpMethod) -> Optional[Tuple[str, int]]:
+        parts = tuple(part.casefold() for part in route.split("/") if part != "")
+        try:
+            if parts and parts[-1].isnumeric():
+                pattern = RoutePattern(parts[:-1], method, True)
+                return (self.parameterized[pattern], int(parts[-1]))
+            return (self.static[RoutePattern(parts, method, False)], None)
+        except KeyError:
+            return None
+
+
+# The same CRUD routes that are generated for every table
+def make_routes(n_tables: int) -> List[Tuple[str, HttpMethod, str]]:
+    routes = list()
+    for i in range(n_tables):
+        table = "table{}".format(i)
+        routes.append(("/{}".format(table), HttpMethod.GET, table + "_getAll"))
+        routes.append(("/{}".format(table), HttpMethod.POST, table + "_create"))
+        for method in (HttpMethod.GET, HttpMethod.PUT, HttpMethod.DELETE):
+            routes.append(("/{}/$id".format(table), method, table + "_" + method))
+    return routes
+
+
+def bench(name: str, router, requests, repeat: int = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path, method in requests:
+            router.match(path, method)
+        best = min(best, time.perf_counter() - start)
+    print(
+        "{:<8} {:>12,.0f} lookups/s {:>8.0f} ns/lookup".format(
+            name, len(requests) / best, best / len(requests) * 1e9
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tables", type=int, default=250)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    routes = make_routes(args.tables)
+    trie, legacy = (RouteTrie(), LegacyRouter())
+    for route, method, name in routes:
+        trie.insert(route, method, name)
+        legacy.insert(route, method, name)
+
+    rng = random.Random(0)
+    requests = list()
+    for _ in range(args.lookups):
+        route, method, _ = rng.choice(routes)
+        requests.append((route.replace("$id", str(rng.randint(1, 10**6))), method))
+
+    # Both routers must agree on the endpoint that was found
+    for path, method in requests[:1000]:
+        assert trie.match(path, method)[0] == legacy.match(path, method)[0]  # type: ignore
+
+    print("{} routes, {} lookups".format(len(routes), len(requests)))
+    bench("legacy", legacy, requests)
+    bench("trie", trie, requests)
+
+
+if __name__ == "__main__":
+    main()
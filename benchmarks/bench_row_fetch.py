@@ -0,0 +1,165 @@
+"""
+Compares PyMySQL's DictCursor against a plain Cursor + the generated Struct
+path of 'silence.db.rows', from the result packets read by the driver to the
+encoded JSON body. The server is replaced by a connection that replays a
+prebuilt text protocol result set, so the driver's parsing and conversions
+are measured along with the rows' construction.
+
+    python benchmarks/bench_row_fetch.py [--rows N] [--cols N] [--repeat N]
+"""
+
+from silence.db.rows import column_names, rows_to_structs
+
+from typing import Callable, List
+
+import argparse
+import io
+import struct
+import time
+import tracemalloc
+
+from msgspec import json
+from pymysql.connections import Connection
+from pymysql.constants import FIELD_TYPE
+from pymysql.cursors import Cursor, DictCursor
+
+UTF8MB4 = 45
+BINARY = 63
+
+# (type, charset, text of the value), the first column is a unique ID
+SAMPLES = (
+    (FIELD_TYPE.LONGLONG, BINARY, b"42"),
+    (FIELD_TYPE.VAR_STRING, UTF8MB4, b"some text value"),
+    (FIELD_TYPE.NEWDECIMAL, BINARY, b"12.50"),
+    (FIELD_TYPE.DATE, BINARY, b"2024-01-31"),
+    (FIELD_TYPE.VAR_STRING, UTF8MB4, None),
+)
+
+
+def lenc_int(n: int) -> bytes:
+    if n < 251:
+        return bytes((n,))
+    if n < 1 << 16:
+        return b"\xfc" + struct.pack("<H", n)
+    if n < 1 << 24:
+        return b"\xfd" + struct.pack("<I", n)[:3]
+    return b"\xfe" + struct.pack("<Q", n)
+
+
+def lenc_str(value) -> bytes:
+    if value is None:
+        return b"\xfb"
+    return lenc_int(len(value)) + value
+
+
+def field_packet(name: str, type_code: int, charset: int) -> bytes:
+    return (
+        b"".join(lenc_str(s) for s in (b"def", b"bench", b"t", b"t"))
+        + lenc_str(name.encode())
+        + lenc_str(name.encode())
+        + b"\x0c"
+        + struct.pack("<HIBHBxx", charset, 255, type_code, 0, 0)
+    )
+
+
+EOF_PACKET = b"\xfe\x00\x00\x02\x00"
+
+
+# The server's response to a SELECT of 'n_rows' rows and 'n_cols' columns
+def make_result(n_rows: int, n_cols: int) -> bytes:
+    samples = [SAMPLES[0]] + [SAMPLES[c % len(SAMPLES)] for c in range(1, n_cols)]
+    payloads: List[bytes] = [lenc_int(n_cols)]
+    payloads.extend(
+        field_packet("column_{}".format(c), type_code, charset)
+        for (c, (type_code, charset, _)) in enumerate(samples)
+    )
+    payloads.append(EOF_PACKET)
+    for r in range(n_rows):
+        payloads.append(
+            lenc_str(str(r).encode())
+            + b"".join(lenc_str(value) for (_, _, value) in samples[1:])
+        )
+    payloads.append(EOF_PACKET)
+
+    wire = bytearray()
+    for seq, payload in enumerate(payloads, start=1):
+        wire += struct.pack("<I", len(payload))[:3] + bytes((seq % 256,)) + payload
+    return bytes(wire)
+
+
+class ReplayConnection(Connection):
+    """
+    Answers every query with the same result set, without a server.
+    """
+
+    def __init__(self, result: bytes):
+        super().__init__(defer_connect=True, charset="utf8mb4")
+        self._replay = result
+
+    def _execute_command(self, command, sql):
+        self._rfile = io.BytesIO(self._replay)
+        self._next_seq_id = 1
+
+    def _read_bytes(self, num_bytes):
+        return self._rfile.read(num_bytes)
+
+
+def dict_path(conn: Connection, encoder: json.Encoder) -> bytes:
+    with conn.cursor(DictCursor) as cursor:
+        cursor.execute("SELECT")
+        return encoder.encode(cursor.fetchall())
+
+
+# What 'silence.db.dal' does
+def struct_path(conn: Connection, encoder: json.Encoder) -> bytes:
+    with conn.cursor(Cursor) as cursor:
+        cursor.execute("SELECT")
+        return encoder.encode(rows_to_structs(column_names(cursor), cursor.fetchall()))
+
+
+def measure(name: str, fn: Callable[[], bytes], n_rows: int, repeat: int):
+    body = fn()  # Warm up (and generate the Struct type)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = time.perf_counter() - start
+
+    print(
+        "{:<8} {:>12,.0f} rows/s {:>10.2f} MiB peak {:>10.2f} MiB body".format(
+            name,
+            n_rows * repeat / elapsed,
+            peak / 2**20,
+            len(body) / 2**20,
+        )
+    )
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = ReplayConnection(make_result(args.rows, args.cols))
+    encoder = json.Encoder()
+
+    print("{} rows x {} columns".format(args.rows, args.cols))
+    dict_body = measure(
+        "dict", lambda: dict_path(conn, encoder), args.rows, args.repeat
+    )
+    struct_body = measure(
+        "struct", lambda: struct_path(conn, encoder), args.rows, args.repeat
+    )
+    assert dict_body == struct_body, "Both paths must produce the same JSON"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from silence.__main__ import CONFIG
+from silence.exceptions import ServerError, ServerErrorWrapper
+from silence.logging.default_logger import logger
+
+from typing import Callable, Optional
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import asyncio
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+#
+# Password hashing and verification are deliberately slow, so they run in a
+# bounded pool of processes instead of on the threads serving requests. At
+# most 'password_max_pending' of them are queued or running at once, further
+# logins are rejected right away instead of waiting behind them.
+#########################################################################
+
+TOO_MANY_LOGINS = ServerError(503, "Too many logins in progress, try again later.")
+
+_EXECUTOR: Optional[ProcessPoolExecutor] = None
+_PENDING = 0
+_LOCK = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _EXECUTOR
+    with _LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ProcessPoolExecutor(
+                max_workers=CONFIG.get().app.auth.password_workers or None
+            )
+        return _EXECUTOR
+
+
+# The pool's processes and the counter belong to the parent
+def _reset_after_fork():
+    global _EXECUTOR, _PENDING, _LOCK
+    _EXECUTOR = None
+    _PENDING = 0
+    _LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _release(_: Optional[Future] = None):
+    global _PENDING
+    with _LOCK:
+        _PENDING -= 1
+
+
+def _submit(fn: Callable, *args) -> Future:
+    global _PENDING
+    executor = _get_executor()
+    with _LOCK:
+        if _PENDING >= CONFIG.get().app.auth.password_max_pending:
+            logger.warning("Rejected a login, %d are already pending", _PENDING)
+            raise ServerErrorWrapper(TOO_MANY_LOGINS)
+        _PENDING += 1
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        _release()
+        raise
+    future.add_done_callback(_release)
+    return future
+
+
+# Number of hashes queued or running, the pool's queue depth
+def pending() -> int:
+    with _LOCK:
+        return _PENDING
+
+
+def hash_password(password: str) -> str:
+    return _submit(generate_password_hash, password).result()
+
+
+def check_password(pwhash: str, password: str) -> bool:
+    return _submit(check_password_hash, pwhash, password).result()
+
+
+async def ahash_password(password: str) -> str:
+    return await asyncio.wrap_future(_submit(generate_password_hash, password))
+
+
+async def acheck_password(pwhash: str, password: str) -> bool:
+    return await asyncio.wrap_future(_submit(check_password_hash, pwhash, password))
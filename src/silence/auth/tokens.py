@@ -1,35 +1,153 @@
 from itsdangerous import URLSafeTimedSerializer as Serializer
-from itsdangerous.exc import BadSignature, SignatureExpired
+from itsdangerous.exc import BadData, SignatureExpired
 
 from silence.__main__ import CONFIG
 from silence.exceptions import TokenError
 from silence.logging.default_logger import logger
 
+from typing import Any, Optional
+from collections import OrderedDict
+
+import hashlib
+import threading
+import time
+
+from msgspec import Struct, msgpack
+
 ###############################################################################
 # Token management: creation and checking
 ###############################################################################
 
-auth = Serializer("hello")
+"""
+A token only carries what's needed to identify the user, the time it was
+issued at is added by the signer. The rest of the user's data is looked up
+on the server when needed (see 'silence.auth.users').
+"""
+
+
+class TokenPayload(Struct, frozen=True, gc=False, array_like=True):
+    id: Any  # The user's primary key
+    """The user's role, if the users table has a role column"""
+    role: Any = None
+
+
+class _PayloadSerializer:
+    @staticmethod
+    def dumps(payload: TokenPayload) -> bytes:
+        return msgpack.encode(payload)
 
+    @staticmethod
+    def loads(data: bytes) -> TokenPayload:
+        return msgpack.decode(data, type=TokenPayload)
 
-def create_token(data):
-    """Creates and returns a new token containing the given user data"""
-    token = auth.dumps(data)
+
+auth = Serializer("hello", serializer=_PayloadSerializer)
+
+
+def create_token(user_id, role=None):
+    """Creates and returns a new token for the user with the given primary key"""
+    # The serializer is binary, but the signed token is URL-safe text
+    token = auth.dumps(TokenPayload(user_id, role)).decode("ascii")
     logger.debug("Created new token %s[silence.]%s", token[:6], token[-6:])
     return token
 
 
 def check_token(token):
-    """Checks whether the provided token is valid. Returns the user's data
+    """Checks whether the provided token is valid. Returns the TokenPayload
     contained inside the token if it is, otherwise raises a TokenError."""
+    token_cache = get_token_cache()
+    if token_cache is not None:
+        key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        payload = token_cache.get(key)
+        if payload is not None:
+            return payload
+
     logger.debug("Checking received token %s[silence.]%s", token[:6], token[-6:])
+    max_age = CONFIG.get().app.auth.max_token_age
     try:
-        user_data = auth.loads(token, max_age=CONFIG.get().app.auth.max_token_age)
+        (payload, issued_at) = auth.loads(token, max_age=max_age, return_timestamp=True)
         logger.debug("The token is correct")
-        return user_data
     except SignatureExpired:
         logger.debug("The token has expired")
         raise TokenError("The session token has expired")
-    except BadSignature:
+    except BadData:
+        # Includes tokens with a valid signature in an older format
         logger.debug("The token is not valid")
         raise TokenError("The session token is not valid")
+
+    if token_cache is not None:
+        token_cache.put(key, payload, issued_at.timestamp() + max_age)  # type: ignore
+    return payload
+
+
+###############################################################################
+# Cache of verified tokens, so that a token that is sent again doesn't need
+# to be verified and decoded again until it expires. Tokens are keyed by
+# their digest, so the cache doesn't hold the tokens themselves.
+###############################################################################
+
+
+class TokenCache:
+    __slots__ = ["_entries", "_max_size", "_lock", "hits", "misses"]
+
+    _entries: OrderedDict[bytes, tuple]  # Digest -> (data, expiration time)
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int):
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: bytes, user_data: Any, expires_at: float):
+        with self._lock:
+            self._entries[key] = (user_data, expires_at)
+            self._entries.move_to_end(key)
+            # Evict the least recently used tokens
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_TOKEN_CACHE: Optional[TokenCache] = None
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+
+# Returns the process' token cache, or None if it's disabled
+def get_token_cache() -> Optional[TokenCache]:
+    global _TOKEN_CACHE
+    _size = CONFIG.get().app.auth.token_cache_size
+    if _size <= 0:
+        return None
+    if _TOKEN_CACHE is None:
+        with _TOKEN_CACHE_LOCK:
+            if _TOKEN_CACHE is None:
+                _TOKEN_CACHE = TokenCache(_size)
+    return _TOKEN_CACHE
@@ -0,0 +1,103 @@
+from silence.__main__ import CONFIG
+from silence.auth.tokens import TokenPayload
+from silence.db import dal
+from silence.sql.builder import get_login_query
+from silence.sql.tables import DATABASE_SCHEMA
+from silence.logging.default_logger import logger
+
+from typing import Any, Dict, Hashable, Optional
+from collections import OrderedDict
+
+import threading
+import time
+
+#
+# Session tokens only carry the user's primary key and role, the rest of
+# the logged user's data is read from the users table when it's needed and
+# kept for a while in a bounded cache. With the cache disabled, the logged
+# user's data is just what the token carries.
+#########################################################################
+
+
+class UserCache:
+    __slots__ = ["_entries", "_ttl", "_max_size", "_lock"]
+
+    _entries: OrderedDict[Hashable, tuple]  # Primary key -> (user, expiration)
+
+    def __init__(self, ttl: float, max_size: int):
+        self._entries = OrderedDict()
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Hashable) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def put(self, user_id: Hashable, user: Dict[str, Any]):
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + self._ttl)
+            self._entries.move_to_end(user_id)
+            # Evict the least recently used users
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: Optional[Hashable] = None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+_USER_CACHE: Optional[UserCache] = None
+_USER_CACHE_LOCK = threading.Lock()
+
+
+# Returns the process' user cache, or None if it's disabled
+def get_user_cache() -> Optional[UserCache]:
+    global _USER_CACHE
+    _auth = CONFIG.get().app.auth
+    if _auth.user_cache_size <= 0:
+        return None
+    if _USER_CACHE is None:
+        with _USER_CACHE_LOCK:
+            if _USER_CACHE is None:
+                _USER_CACHE = UserCache(_auth.user_cache_ttl, _auth.user_cache_size)
+    return _USER_CACHE
+
+
+# Returns the logged user's data, without the password, or None if the user
+# doesn't exist anymore
+def get_session_user(payload: TokenPayload) -> Optional[Dict[str, Any]]:
+    users_table = CONFIG.get().app.auth.user_auth_table
+    table = DATABASE_SCHEMA.get_table(users_table)
+    if table is None or not table.primary_key_field:
+        return None
+
+    user_cache = get_user_cache()
+    if user_cache is None:
+        return {table.primary_key_field: payload.id, "role": payload.role}
+
+    user = user_cache.get(payload.id)
+    if user is None:
+        users = dal.query(
+            get_login_query(users_table, table.primary_key_field, payload.id)
+        )
+        if not users:
+            logger.debug("The logged user %s doesn't exist anymore", payload.id)
+            return None
+        user = users[0]
+        for field in table.fields:
+            if field.name.casefold() == "password":
+                del user[field.name]
+        user_cache.put(payload.id, user)
+    # The cached user is shared by every request
+    return dict(user)
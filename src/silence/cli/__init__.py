@@ -1,7 +1,7 @@
 from silence.__main__ import CONFIG
 from silence.__version__ import __version__
 
-from silence.logging.default_logger import logger
+from silence.logging.default_logger import logger, start_queue_logging
 from silence.cli.commands import (
     run,
     createdb,
@@ -49,10 +49,25 @@ def main():
     group.add_argument("--url", help="URL to a Git repo containing a project to clone")
     group.add_argument("--blank", action="store_true", help="Alias to --template blank")
 
-    subparsers.add_parser(
+    parser_createdb = subparsers.add_parser(
         "createdb",
         help="Runs the provided SQL scripts in the adequate order in the database",
     )
+    parser_createdb.add_argument(
+        "--echo", action="store_true", help="Prints every statement that is executed"
+    )
+    parser_createdb.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Connections that load independent data scripts at once",
+    )
+    parser_createdb.add_argument(
+        "--no-checks",
+        action="store_true",
+        default=None,
+        help="Loads data scripts in parallel without foreign key nor unique checks",
+    )
     subparsers.add_parser("run", help="Starts the web server")
     subparsers.add_parser(
         "createapi",
@@ -112,6 +127,7 @@ def main():
                 pass
             case _:
                 CONFIG.load_config()
+                start_queue_logging()
         _get_handler()(args)
     except Exception as e:
         match CONFIG.debug:
@@ -3,5 +3,5 @@ from silence.db.populate import create_database
 
 def handle(args):
     print("Creating the database silence.")
-    create_database()
+    create_database(echo=args.echo, jobs=args.jobs, relax_checks=args.no_checks)
     print("Done!")
@@ -25,15 +25,45 @@ class General(
     colored_output: bool = field(default=True)
     default_template: Tuple[str, str] = field(default=("IISSI-US", "employees"))
     check_latest_version: bool = field(default=True)
+    """Reuse the database's schema snapshot while the schema doesn't change"""
+    schema_cache: bool = field(default=True)
+    """Log records waiting to be written by the logging thread, 0 writes them as they're logged"""
+    log_queue_size: int = field(default=10000)
+    """What to do with records once the log queue is full: drop them or wait for room"""
+    log_overflow: Literal["drop", "block"] = field(default="drop")
 
 
 class Server(Base, frozen=True, gc=False):
     listen_addr: Tuple[str, int] = field(default=("127.0.0.1", 8080))
+    """Seconds GET results are cached in memory and by clients, 0 disables caching"""
     http_cache_time: int = field(default=0)
+    """Memory cap of the in-process GET results cache"""
+    result_cache_max_bytes: int = field(default=64 * 1024 * 1024)
     api_prefix: str = field(default="/api")
     serve_api: bool = field(default=True)
     serve_static_files: bool = field(default=True)
     summary_endpoint: bool = field(default=True)
+    """Serve the endpoint statistics at '/_stats', to anyone who can reach the server"""
+    stats_endpoint: bool = field(default=False)
+    """SELECT results with more rows than this are streamed, 0 only streams endpoints marked with 'stream'"""
+    stream_threshold_rows: int = field(default=0)
+    """Rows fetched from the database per streamed chunk"""
+    stream_chunk_rows: int = field(default=1000)
+    """Rows sent per statement by the bulk endpoints, all of them in one transaction"""
+    bulk_chunk_rows: int = field(default=1000)
+    """Server processes, each one with its own database pools and endpoints"""
+    workers: int = field(default=1)
+    """Runtime threads of each worker"""
+    threads: int = field(default=1)
+    backlog: int = field(default=1024)
+    """Granian's runtime mode: 'auto', 'mt' (multi-threaded) or 'st' (single-threaded), only with several workers"""
+    runtime_mode: Literal["auto", "mt", "st"] = field(default="auto")
+    """File the API's access log is appended to as JSON lines, '-' is stdout and an empty string disables it"""
+    access_log: str = field(default="")
+    """Fraction of the successful requests that are logged, errors are always logged"""
+    access_log_sample_rate: float = field(default=1.0)
+    """Seconds the access log is buffered before being written"""
+    access_log_flush_interval: float = field(default=1.0)
 
 
 """By default, passwords, roles (e.g. admin or whether the user is active) and tokens will be stored in their own tables"""
@@ -45,6 +75,16 @@ class Auth(Base, frozen=True, gc=False):
     user_auth_table: str = field(default="users")
     user_auth_field: str = field(default="email")
     max_token_age: int = 86400
+    """Verified tokens kept in memory until they expire, 0 verifies every token"""
+    token_cache_size: int = field(default=1024)
+    """Logged users' data kept in memory, 0 only keeps what their token carries"""
+    user_cache_size: int = field(default=0)
+    """Seconds a logged user's data is kept in memory"""
+    user_cache_ttl: int = field(default=60)
+    """Processes that hash and check passwords, 0 uses one per CPU"""
+    password_workers: int = field(default=0)
+    """Passwords queued or being hashed at once, further logins are rejected"""
+    password_max_pending: int = field(default=64)
     # chech_user_is_active: bool # DEPRECATED
     # secret_key: str # DEPRECATED
     allow_signup: bool = field(default=True)
@@ -61,6 +101,21 @@ class DbConn(Base, frozen=True, gc=False):
     password: str = field(default="default_password")
     db: str = field(default="default_db")
     bootstrap_scripts: List[str] = field(default_factory=list)
+    """Connections that load independent data scripts at once, 1 runs every script in order"""
+    bootstrap_workers: int = field(default=1)
+    """Load data scripts in parallel without foreign key nor unique checks, only for data known to be consistent"""
+    bootstrap_relax_checks: bool = field(default=False)
+    """Bounds of the connection pool, 'pool_min_size' connections are opened on first use"""
+    pool_min_size: int = field(default=1)
+    pool_max_size: int = field(default=10)
+    """Connections (and worker threads) available to the async DAL used by the server"""
+    async_pool_max_size: int = field(default=32)
+    """Seconds after which a pooled connection is closed and replaced"""
+    pool_max_lifetime: float = field(default=3600)
+    """Seconds to wait for a free connection before failing"""
+    pool_acquire_timeout: float = field(default=10)
+    """Idle connections are pinged on checkout if they've been idle for this many seconds"""
+    pool_ping_interval: float = field(default=5)
 
 
 class Config(Base, frozen=True, gc=False):
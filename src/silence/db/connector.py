@@ -1,9 +1,20 @@
 from silence.__main__ import CONFIG
+from silence.exceptions import DatabaseError
+from silence.logging.default_logger import logger
 
-from pymysql import connect, OperationalError
+from typing import Callable, Deque, Iterator, Optional
+from collections import deque
+from contextlib import contextmanager
 
+import os
+import threading
+import time
 
-def get_conn():
+from pymysql import connect, OperationalError, InterfaceError
+from pymysql.connections import Connection
+
+
+def get_conn(**kwargs) -> Connection:
     _conn = CONFIG.get().db_conn
     try:
         return connect(
@@ -12,6 +23,237 @@ def get_conn():
             user=_conn.username,
             password=_conn.password,
             database=_conn.db,
+            **kwargs,
         )
     except OperationalError:
         raise Exception("Cannot establish connection to the database.")
+
+
+#
+# Bounded and thread-safe pool of database connections. Connections are
+# borrowed with 'ConnectionPool.connection()' and given back to the pool
+# when the 'with' block ends, so the TCP and authentication handshake is
+# only paid when the pool has to grow or recycle a connection.
+#########################################################################
+
+
+class _PooledConnection:
+    __slots__ = ["conn", "created_at", "last_used"]
+
+    conn: Connection
+    created_at: float
+    last_used: float
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    __slots__ = [
+        "_connect",
+        "_min_size",
+        "_max_size",
+        "_max_lifetime",
+        "_acquire_timeout",
+        "_ping_interval",
+        "_idle",
+        "_size",
+        "_closed",
+        "_cond",
+    ]
+
+    _connect: Callable[[], Connection]
+    _idle: Deque[_PooledConnection]
+    _size: int  # Connections that are either idle or borrowed
+
+    def __init__(
+        self,
+        connect_fn: Callable[[], Connection],
+        min_size: int,
+        max_size: int,
+        max_lifetime: float,
+        acquire_timeout: float,
+        ping_interval: float,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(
+                "Invalid pool size, expected 0 <= pool_min_size <= pool_max_size and pool_max_size >= 1."
+            )
+        self._connect = connect_fn
+        self._min_size = min_size
+        self._max_size = max_size
+        self._max_lifetime = max_lifetime
+        self._acquire_timeout = acquire_timeout
+        self._ping_interval = ping_interval
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+        for _ in range(min_size):
+            self._idle.append(_PooledConnection(self._connect()))
+            self._size += 1
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        pooled = self._acquire()
+        discard = False
+        try:
+            yield pooled.conn
+        except (OperationalError, InterfaceError):
+            # The connection may be broken, don't give it back to the pool
+            discard = True
+            raise
+        except BaseException:
+            # Don't leak a half-done transaction to the next borrower
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self._release(pooled, discard)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._close_quietly(self._idle.popleft())
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle)}
+
+    def _acquire(self) -> _PooledConnection:
+        deadline = time.monotonic() + self._acquire_timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise DatabaseError("The connection pool has been closed.")
+                pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    if self._size < self._max_size:
+                        # Reserve the slot and connect outside the lock
+                        self._size += 1
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            raise DatabaseError(
+                                "Timed out after {}s waiting for a database connection "
+                                "(pool_max_size = {}).".format(
+                                    self._acquire_timeout, self._max_size
+                                )
+                            )
+                        continue
+
+            if pooled is None:
+                try:
+                    return _PooledConnection(self._connect())
+                except BaseException:
+                    self._forget()
+                    raise
+
+            if self._is_usable(pooled):
+                return pooled
+
+            self._close_quietly(pooled)
+            self._forget()
+
+    def _release(self, pooled: _PooledConnection, discard: bool = False):
+        now = time.monotonic()
+        if (
+            discard
+            or self._closed
+            or now - pooled.created_at >= self._max_lifetime
+            or not pooled.conn.open
+        ):
+            self._close_quietly(pooled)
+            self._forget()
+            return
+        pooled.last_used = now
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    # Checks, on checkout, whether an idle connection can still be used
+    def _is_usable(self, pooled: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if now - pooled.created_at >= self._max_lifetime:
+            logger.debug("Recycling a pooled connection that exceeded its lifetime")
+            return False
+        if now - pooled.last_used >= self._ping_interval:
+            try:
+                pooled.conn.ping(reconnect=False)
+            except Exception:
+                logger.debug("Discarding a pooled connection that failed its ping")
+                return False
+        return True
+
+    # Frees the slot of a connection that was closed or never opened
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(pooled: _PooledConnection):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+
+_POOL: Optional[ConnectionPool] = None
+_ASYNC_POOL: Optional[ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _new_pool(max_size: int) -> ConnectionPool:
+    _conn = CONFIG.get().db_conn
+    # Pooled connections autocommit so that an idle connection never
+    # keeps a stale transaction snapshot open, writes that need a
+    # transaction must call 'begin()' explicitly
+    return ConnectionPool(
+        lambda: get_conn(autocommit=True),
+        min_size=min(_conn.pool_min_size, max_size),
+        max_size=max_size,
+        max_lifetime=_conn.pool_max_lifetime,
+        acquire_timeout=_conn.pool_acquire_timeout,
+        ping_interval=_conn.pool_ping_interval,
+    )
+
+
+# Returns the process' connection pool, creating it on first use so that
+# it's built after the config has been loaded
+def get_pool() -> ConnectionPool:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = _new_pool(CONFIG.get().db_conn.pool_max_size)
+    return _POOL
+
+
+# Returns the pool used by the async DAL, it's kept apart from the blocking
+# one so that the event loop never competes with blocking callers for a slot
+def get_async_pool() -> ConnectionPool:
+    global _ASYNC_POOL
+    if _ASYNC_POOL is None:
+        with _POOL_LOCK:
+            if _ASYNC_POOL is None:
+                _ASYNC_POOL = _new_pool(CONFIG.get().db_conn.async_pool_max_size)
+    return _ASYNC_POOL
+
+
+# A forked process (e.g. a server worker) can't share the parent's sockets,
+# so it drops the inherited pools without closing them and builds its own
+def _reset_pools_after_fork():
+    global _POOL, _ASYNC_POOL, _POOL_LOCK
+    _POOL = None
+    _ASYNC_POOL = None
+    _POOL_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
@@ -1,8 +1,31 @@
-from pymysql.cursors import DictCursor
+from pymysql.cursors import Cursor, DictCursor, SSCursor
 
-from silence.db.connector import get_conn
+from silence.__main__ import CONFIG
+from silence.db.connector import ConnectionPool, get_pool, get_async_pool
+from silence.db.rows import column_names, rows_to_structs
 from silence.exceptions import DatabaseError
 from silence.logging.default_logger import logger
+from silence.logging.truncated import Truncated
+
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import os
+import sys
+import threading
+
+from msgspec import Struct
 
 #
 # The DAL (Data Access Layer) functions provide an abstraction layer
@@ -12,58 +35,348 @@ from silence.logging.default_logger import logger
 
 # Query method to retrieve information
 def query(q, params=None):
+    return _query(get_pool(), q, params)
+
+
+# Query method that returns the column names and the rows as tuples, which
+# avoids building a dict per row (see 'silence.db.rows')
+def query_rows(q, params=None) -> Tuple[Tuple[str, ...], Sequence[tuple]]:
+    return _query_rows(get_pool(), q, params)
+
+
+# Update method to modify information
+def update(q, params=None):
+    return _update(get_pool(), q, params)
+
+
+# Runs an INSERT, UPDATE or DELETE once per set of parameters inside a single
+# transaction, sent in chunks of 'chunk_size' rows. 'auto_id' and 'id_param'
+# tell whether the INSERT's table has an auto_increment key and which of the
+# parameters is the key's value, as in 'CompiledQuery'.
+def update_many(
+    q,
+    params_seq: Sequence[Sequence],
+    chunk_size=1000,
+    auto_id: bool = False,
+    id_param: Optional[int] = None,
+):
+    return _update_many(get_pool(), q, params_seq, chunk_size, auto_id, id_param)
+
+
+# Runs several statements on one connection and commits them together. The
+# parameters of each statement are bound right before it runs, so that they
+# can use the ID generated by a previous INSERT as 'lastId'.
+def transaction(
+    statements: Sequence[Tuple[str, Callable[[Mapping[str, Any]], Sequence]]],
+    values: Dict[str, Any],
+):
+    return _transaction(get_pool(), statements, values)
+
+
+# Runs a write and reads back the affected rows on the same connection and
+# transaction. Without 'fetch_params', the fetch query's only placeholder
+# is filled with the ID generated by the write.
+def update_and_fetch(q, params, fetch_q, fetch_params=None):
+    return _update_and_fetch(get_pool(), q, params, fetch_q, fetch_params)
+
+
+#
+# Async versions of the DAL functions for the RSGI server. PyMySQL is a
+# blocking driver, so the statements run in a bounded thread pool backed
+# by its own connection pool while the event loop keeps serving requests.
+#########################################################################
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(
+                    max_workers=CONFIG.get().db_conn.async_pool_max_size,
+                    thread_name_prefix="silence-db",
+                )
+    return _EXECUTOR
+
+
+# The executor's threads don't survive a fork, the child creates its own
+def _reset_executor_after_fork():
+    global _EXECUTOR, _EXECUTOR_LOCK
+    _EXECUTOR = None
+    _EXECUTOR_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+
+async def aquery(q, params=None):
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), _query, get_async_pool(), q, params
+    )
+
+
+async def aquery_rows(q, params=None) -> Tuple[Tuple[str, ...], Sequence[tuple]]:
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), _query_rows, get_async_pool(), q, params
+    )
+
+
+async def aupdate(q, params=None):
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), _update, get_async_pool(), q, params
+    )
+
+
+async def aupdate_many(
+    q,
+    params_seq: Sequence[Sequence],
+    chunk_size=1000,
+    auto_id: bool = False,
+    id_param: Optional[int] = None,
+):
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(),
+        _update_many,
+        get_async_pool(),
+        q,
+        params_seq,
+        chunk_size,
+        auto_id,
+        id_param,
+    )
+
+
+async def atransaction(
+    statements: Sequence[Tuple[str, Callable[[Mapping[str, Any]], Sequence]]],
+    values: Dict[str, Any],
+):
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), _transaction, get_async_pool(), statements, values
+    )
+
+
+# Runs a query on an unbuffered server-side cursor and yields its rows in
+# chunks (as Structs, see 'silence.db.rows'), so that large results never
+# have to be held in memory at once. The connection stays borrowed until the
+# iteration ends or is abandoned.
+async def astream(q, params=None, chunk_size=1000) -> AsyncIterator[List[Struct]]:
+    logger.debug('Streaming SQL query "%s" with params %s', q, params)
+
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    borrowed = get_async_pool().connection()
+    conn = await loop.run_in_executor(executor, borrowed.__enter__)
+    exc_info = (None, None, None)
+    try:
+        cursor = conn.cursor(SSCursor)
+        try:
+            await loop.run_in_executor(executor, cursor.execute, q, params or None)
+            columns = column_names(cursor)
+            while True:
+                rows = await loop.run_in_executor(
+                    executor, cursor.fetchmany, chunk_size
+                )
+                if not rows:
+                    break
+                yield rows_to_structs(columns, rows)
+        finally:
+            # Closing an unbuffered cursor reads whatever rows are left
+            await loop.run_in_executor(executor, cursor.close)
+    except BaseException as exc:
+        exc_info = (type(exc), exc, exc.__traceback__)
+        if isinstance(exc, Exception) and not isinstance(exc, DatabaseError):
+            # If anything happens, wrap the exceptions in a DatabaseError
+            raise DatabaseError(exc) from exc
+        raise
+    finally:
+        # Give the connection back, discarding it if it was left unusable
+        await loop.run_in_executor(executor, borrowed.__exit__, *exc_info)
+
+
+def _query(pool: ConnectionPool, q, params=None):
     logger.debug('Executing SQL query "%s" with params %s', q, params)
 
-    # Fetch the connection and get a cursor
-    conn = get_conn()
-    cursor = conn.cursor(DictCursor)
     try:
-        # Execute the query, with or without parameters and return the result
-        if params:
-            cursor.execute(q, params)
-        else:
-            cursor.execute(q)
-
-        res = cursor.fetchall()
-        logger.debug("Query result: %s", res)
-        return res
+        # Borrow a connection from the pool and get a cursor
+        with pool.connection() as conn, conn.cursor(DictCursor) as cursor:
+            # Execute the query, with or without parameters and return the result
+            if params:
+                cursor.execute(q, params)
+            else:
+                cursor.execute(q)
+
+            res = cursor.fetchall()
+            logger.debug("Query result: %s", Truncated(res))
+            return res
+    except DatabaseError:
+        raise
     except Exception as exc:
         # If anything happens, wrap the exceptions in a DatabaseError
         raise DatabaseError(exc) from exc
-    finally:
-        # Close the cursor and the connection
-        cursor.close()
-        conn.close()
 
 
-# Update method to modify information
-def update(q, params=None):
-    logger.debug(f'Executing SQL operation "%s" with params %s', q, params)
-    conn = get_conn()
-    cursor = conn.cursor(DictCursor)
+def _query_rows(
+    pool: ConnectionPool, q, params=None
+) -> Tuple[Tuple[str, ...], Sequence[tuple]]:
+    logger.debug('Executing SQL query "%s" with params %s', q, params)
 
-    # Fetch the connection and get a cursor
     try:
-        # Execute the query, with or without parameters and return the result
-        if params:
-            cursor.execute(q, params)
-        else:
-            cursor.execute(q)
-
-        conn.commit()
-
-        # Return the ID of the row that was modified or inserted
-        lastid = cursor.lastrowid
-        logger.debug("Last modified row ID: %s", lastid)
-        res = {"lastId": lastid}
-        return res
+        with pool.connection() as conn, conn.cursor(Cursor) as cursor:
+            if params:
+                cursor.execute(q, params)
+            else:
+                cursor.execute(q)
+
+            # The column names are captured once for the whole result
+            res = (column_names(cursor), cursor.fetchall())
+            logger.debug("Query result: %s", Truncated(res))
+            return res
+    except DatabaseError:
+        raise
+    except Exception as exc:
+        # If anything happens, wrap the exceptions in a DatabaseError
+        raise DatabaseError(exc) from exc
+
+
+def _update(pool: ConnectionPool, q, params=None):
+    logger.debug('Executing SQL operation "%s" with params %s', q, params)
+    try:
+        # Borrow a connection from the pool and get a cursor
+        with pool.connection() as conn, conn.cursor(DictCursor) as cursor:
+            # Execute the query, with or without parameters and return the result
+            if params:
+                cursor.execute(q, params)
+            else:
+                cursor.execute(q)
+
+            conn.commit()
+
+            # Return the ID of the row that was modified or inserted
+            lastid = cursor.lastrowid
+            logger.debug("Last modified row ID: %s", lastid)
+            res = {"lastId": lastid}
+            return res
+    except DatabaseError:
+        raise
+    except Exception as exc:
+        # If anything happens, wrap the exceptions in a DatabaseError
+        raise DatabaseError(exc) from exc
+
+
+# PyMySQL's 'executemany' sends an INSERT ... VALUES as a single multi-row
+# statement and other statements one by one. Chunks are never split further
+# by the driver, so the IDs generated by each chunk's INSERT are consecutive
+# (with the default auto_increment_increment of 1), as long as every row's
+# key is generated. If every row gives its own key those are the IDs, in any
+# other case only the first ID the database reports is known. A failure
+# rolls back every row.
+def _update_many(
+    pool: ConnectionPool,
+    q,
+    params_seq: Sequence[Sequence],
+    chunk_size,
+    auto_id: bool = False,
+    id_param: Optional[int] = None,
+):
+    logger.debug(
+        'Executing SQL operation "%s" for %d rows in chunks of %d',
+        q,
+        len(params_seq),
+        chunk_size,
+    )
+    chunk_size = max(chunk_size, 1)
+    given = (
+        [params[id_param] for params in params_seq] if id_param is not None else None
+    )
+    generated = auto_id and (given is None or all(key is None for key in given))
+    try:
+        with pool.connection() as conn, conn.cursor(Cursor) as cursor:
+            cursor.max_stmt_length = sys.maxsize
+            conn.begin()
+            ids: List[Any] = list()
+            first_id = None
+            count = 0
+            for i in range(0, len(params_seq), chunk_size):
+                chunk = params_seq[i : i + chunk_size]
+                cursor.executemany(q, chunk)
+                count += cursor.rowcount
+                if cursor.lastrowid and first_id is None:
+                    first_id = cursor.lastrowid
+                if cursor.lastrowid and generated:
+                    ids.extend(range(cursor.lastrowid, cursor.lastrowid + len(chunk)))
+            conn.commit()
+
+            # Return the IDs of the inserted rows when they're known, and the
+            # number of affected rows
+            res: Dict[str, Any] = {"count": count}
+            if generated:
+                res["ids"] = ids
+            elif given is not None and all(key is not None for key in given):
+                res["ids"] = given
+            elif first_id is not None:
+                res["firstId"] = first_id
+            logger.debug("Bulk operation result: %s", Truncated(res))
+            return res
+    except DatabaseError:
+        raise
+    except Exception as exc:
+        # If anything happens, wrap the exceptions in a DatabaseError
+        raise DatabaseError(exc) from exc
+
+
+def _update_and_fetch(pool: ConnectionPool, q, params, fetch_q, fetch_params=None):
+    logger.debug('Executing SQL operation "%s" with params %s', q, params)
+    try:
+        with pool.connection() as conn, conn.cursor(DictCursor) as cursor:
+            conn.begin()
+            cursor.execute(q, params or None)
+            if fetch_params is None:
+                fetch_params = (cursor.lastrowid,)
+            logger.debug(
+                'Executing SQL query "%s" with params %s', fetch_q, fetch_params
+            )
+            cursor.execute(fetch_q, fetch_params)
+            res = cursor.fetchall()
+            conn.commit()
+
+            logger.debug("Query result: %s", Truncated(res))
+            return res
+    except DatabaseError:
+        raise
+    except Exception as exc:
+        # If anything happens, wrap the exceptions in a DatabaseError
+        raise DatabaseError(exc) from exc
+
+
+def _transaction(
+    pool: ConnectionPool,
+    statements: Sequence[Tuple[str, Callable[[Mapping[str, Any]], Sequence]]],
+    values: Dict[str, Any],
+):
+    try:
+        with pool.connection() as conn, conn.cursor(Cursor) as cursor:
+            conn.begin()
+            for q, bind in statements:
+                params = bind(values)
+                logger.debug('Executing SQL operation "%s" with params %s', q, params)
+                cursor.execute(q, params or None)
+                if cursor.lastrowid:
+                    values["lastId"] = cursor.lastrowid
+            conn.commit()
+
+            # Return the ID generated by the last INSERT, as 'update' does
+            lastid = values.get("lastId")
+            logger.debug("Last modified row ID: %s", lastid)
+            res = {"lastId": lastid}
+            return res
+    except DatabaseError:
+        raise
     except Exception as exc:
         # If anything happens, wrap the exceptions in a DatabaseError
         raise DatabaseError(exc) from exc
-    finally:
-        # Close the cursor and the connection
-        cursor.close()
-        conn.close()
 
 
 # Safe wrappers for the API, which return an HTTPError instead of a
@@ -0,0 +1,252 @@
+from silence.exceptions import DatabaseError
+from silence.sql.tables import DATABASE_SCHEMA, DatabaseSchema, TableSchema
+
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from itertools import chain
+
+import csv
+import os
+import threading
+
+from msgspec import json
+from pymysql.err import OperationalError
+
+#
+# Seed data given as CSV, TSV or NDJSON files instead of SQL scripts. The
+# file's name (up to its first dot) is the table it's loaded into, and its
+# header (or the first object's keys) the columns, which are looked up in
+# the database's schema. CSV and TSV files are sent as they are with LOAD
+# DATA LOCAL INFILE when the server allows it, otherwise they're inserted in
+# large batches with 'executemany', as NDJSON files always are.
+# In CSV and TSV files, an empty field of a nullable column and '\N' are NULL.
+# LOAD DATA LOCAL turns rejected rows (duplicate keys, bad values) into
+# warnings, those are raised as errors so a file loads the same both ways.
+#########################################################################
+
+DATA_FILE_DELIMITERS = {".csv": ",", ".tsv": "\t"}
+DATA_FILE_EXTENSIONS = frozenset((".csv", ".tsv", ".ndjson", ".jsonl"))
+# Rows sent per 'executemany', PyMySQL packs them in multi-row INSERTs
+DATA_BATCH_ROWS = 10000
+# Warnings listed in the error raised when LOAD DATA rejects rows
+MAX_REPORTED_WARNINGS = 5
+# Errors raised when the server or the client don't allow LOAD DATA LOCAL
+_LOCAL_INFILE_DISABLED = frozenset((1148, 2068, 3948))
+_NULL = "\\N"
+
+_SCHEMA_LOCK = threading.Lock()
+
+
+def is_data_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in DATA_FILE_EXTENSIONS
+
+
+def data_file_table(path: str) -> str:
+    return os.path.basename(path).split(".", 1)[0]
+
+
+# Loads the file into its table and returns the number of rows loaded, the
+# progress is reported by the bytes read (except through LOAD DATA)
+def load_data_file(
+    cursor,
+    path: str,
+    echo: bool = False,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    table = _table_schema(data_file_table(path))
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in DATA_FILE_DELIMITERS:
+        delimiter = DATA_FILE_DELIMITERS[extension]
+        with open(path, "rb") as f:
+            first_line = f.readline()
+        header = next(
+            csv.reader([first_line.decode("utf-8-sig")], **_dialect(delimiter))
+        )
+        columns = _columns(table, header, path)
+        try:
+            return _load_data_infile(
+                cursor, path, table, columns, delimiter, first_line, echo
+            )
+        except OperationalError as e:
+            if e.args[0] not in _LOCAL_INFILE_DISABLED:
+                raise
+        nullable = [_nullable(table, column) for column in columns]
+        rows = (
+            tuple(
+                None if value == _NULL or (value == "" and nullable[i]) else value
+                for (i, value) in enumerate(row)
+            )
+            for row in csv.reader(_lines(path, progress, skip=1), **_dialect(delimiter))
+            if row
+        )
+    else:
+        (columns, rows) = _ndjson_rows(table, path, progress)
+
+    return _insert_rows(cursor, table, columns, rows, echo)
+
+
+def _nullable(table: TableSchema, column: str) -> bool:
+    return next(f.nullable for f in table.fields if f.name == column)
+
+
+# Uses DATABASE_SCHEMA, or introspects the database again if the table was
+# created after the schema was loaded
+def _table_schema(table_name: str) -> TableSchema:
+    with _SCHEMA_LOCK:
+        if len(DATABASE_SCHEMA.tables) == 0:
+            DATABASE_SCHEMA.load_tables()
+        table = DATABASE_SCHEMA.get_table(table_name)
+        if table is None:
+            table = DatabaseSchema.new_from_db().get_table(table_name)
+    if table is None or table.is_view:
+        raise DatabaseError(
+            "Cannot load the data file for '{}', there's no such table".format(
+                table_name
+            )
+        )
+    return table
+
+
+# Returns the columns' names as they are in the table
+def _columns(table: TableSchema, names: List[str], path: str) -> List[str]:
+    fields = {f.name.casefold(): f.name for f in table.fields}
+    columns = list()
+    for name in names:
+        column = fields.get(name.strip().casefold())
+        if column is None:
+            raise DatabaseError(
+                "The column '{}' of {} isn't in the table '{}'".format(
+                    name, path, table.name
+                )
+            )
+        columns.append(column)
+    return columns
+
+
+def _dialect(delimiter: str) -> dict:
+    if delimiter == "\t":
+        return {"delimiter": delimiter, "quoting": csv.QUOTE_NONE}
+    return {"delimiter": delimiter}
+
+
+def _load_data_infile(
+    cursor,
+    path: str,
+    table: TableSchema,
+    columns: List[str],
+    delimiter: str,
+    first_line: bytes,
+    echo: bool,
+) -> int:
+    variables = ["@c{}".format(i) for i in range(len(columns))]
+    assignments = ", ".join(
+        "`{}` = {}".format(
+            column,
+            (
+                "NULLIF(NULLIF({0}, ''), '\\\\N')".format(variable)
+                if _nullable(table, column)
+                else "NULLIF({}, '\\\\N')".format(variable)
+            ),
+        )
+        for (column, variable) in zip(columns, variables)
+    )
+    q = (
+        "LOAD DATA LOCAL INFILE %s INTO TABLE `{}` CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY %s {}ESCAPED BY '' "
+        "LINES TERMINATED BY %s IGNORE 1 LINES ({}) SET {}".format(
+            table.name,
+            "OPTIONALLY ENCLOSED BY '\"' " if delimiter != "\t" else "",
+            ", ".join(variables),
+            assignments,
+        )
+    )
+    params = (
+        os.path.abspath(path),
+        delimiter,
+        "\r\n" if first_line.endswith(b"\r\n") else "\n",
+    )
+    if echo:
+        print(cursor.mogrify(q, params))
+    cursor.execute(q, params)
+    count = cursor.rowcount
+
+    cursor.execute("SHOW WARNINGS")
+    warnings = [row for row in cursor.fetchall() if row[0] != "Note"]
+    if warnings:
+        raise DatabaseError(
+            "Cannot load {}, some rows were rejected ({} warnings): {}".format(
+                path,
+                len(warnings),
+                "; ".join(
+                    "({}) {}".format(code, message)
+                    for (_, code, message) in warnings[:MAX_REPORTED_WARNINGS]
+                ),
+            )
+        )
+    return count
+
+
+# Yields the file's lines as text, counting the bytes read
+def _lines(
+    path: str, progress: Optional[Callable[[int], None]], skip: int = 0
+) -> Iterator[str]:
+    read = 0
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            read += len(line)
+            if i >= skip:
+                yield line.decode("utf-8-sig" if i == 0 else "utf-8")
+            if progress is not None and i % 1024 == 0:
+                progress(read)
+
+
+def _ndjson_rows(
+    table: TableSchema, path: str, progress: Optional[Callable[[int], None]]
+) -> Tuple[List[str], Iterator[tuple]]:
+    decoder = json.Decoder(dict)
+    lines = (line for line in _lines(path, progress) if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return (list(), iter(()))
+    first_row = decoder.decode(first)
+    keys = list(first_row.keys())
+    columns = _columns(table, keys, path)
+
+    def rows() -> Iterator[tuple]:
+        for obj in chain((first_row,), (decoder.decode(line) for line in lines)):
+            yield tuple(_ndjson_value(obj.get(key)) for key in keys)
+
+    return (columns, rows())
+
+
+# Objects and lists are stored as their JSON text
+def _ndjson_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.encode(value).decode("utf-8")
+    return value
+
+
+def _insert_rows(
+    cursor, table: TableSchema, columns: List[str], rows: Iterator[tuple], echo: bool
+) -> int:
+    if not columns:
+        return 0
+    q = "INSERT INTO `{}` ({}) VALUES ({})".format(
+        table.name,
+        ", ".join("`{}`".format(column) for column in columns),
+        ", ".join(["%s"] * len(columns)),
+    )
+    if echo:
+        print(q)
+    count = 0
+    batch: List[tuple] = list()
+    for row in rows:
+        batch.append(row)
+        if len(batch) == DATA_BATCH_ROWS:
+            cursor.executemany(q, batch)
+            count += len(batch)
+            batch = list()
+    if batch:
+        cursor.executemany(q, batch)
+        count += len(batch)
+    return count
@@ -1,55 +1,82 @@
 from silence.__main__ import CONFIG
 from silence.db.connector import get_conn
+from silence.db.data_files import data_file_table, is_data_file, load_data_file
+from silence.sql.splitter import SqlSplitter, first_keyword
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import codecs
+import os
+import re
+import sys
+import time
+
+from msgspec import Struct
+from pymysql.constants import CLIENT
 
 #
 # Reads and executes the SQL scripts needed to create the database
 # and fill it with data, as defined in the settings.
 #
 
+# Bytes read from a script at once
+SCRIPT_CHUNK_SIZE = 1024 * 1024
+# Consecutive INSERTs are sent together, in packets of at most this size
+# (below MySQL's smallest default 'max_allowed_packet')
+INSERT_BATCH_BYTES = 1024 * 1024
+
 
-def create_database():
-    conn = get_conn()
+def create_database(
+    echo: bool = False, jobs: Optional[int] = None, relax_checks: Optional[bool] = None
+):
+    conn = get_conn(client_flag=CLIENT.MULTI_STATEMENTS, local_infile=True)
     cursor = conn.cursor()
     db_name = CONFIG.get().db_conn.db
+    scripts = CONFIG.get().db_conn.bootstrap_scripts
+    if jobs is None:
+        jobs = CONFIG.get().db_conn.bootstrap_workers
+    if relax_checks is None:
+        relax_checks = CONFIG.get().db_conn.bootstrap_relax_checks
+    started_at = time.perf_counter()
+    reports: List[ScriptReport] = list()
 
     cursor.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
     cursor.execute(f"CREATE DATABASE `{db_name}`")
     conn.commit()
 
-    for script in CONFIG.get().db_conn.bootstrap_scripts:
+    # Scripts are only read ahead when some of them may run at the same time
+    if jobs > 1 and len(scripts) > 1:
+        stages = _plan_scripts(scripts)
+    else:
+        stages = [[(script, None)] for script in scripts]
+
+    for stage in stages:
         cursor.execute(f"USE `{db_name}`")
-        print_str = f"Executing {script}:"
-        print_aux_len = len(print_str) + 2
-
-        print("=" * print_aux_len)
-        print(f" {print_str} ")
-        print("=" * print_aux_len, "\n")
-
-        with open(f"sql/{script}", "r", encoding="utf-8") as f:
-            stmt = ""
-            delimiter = ";"
-            for line in f:
-                if not line or line.strip() == "":
-                    continue  # Skip blank lines
-
-                # Emulate the DELIMITER sentence
-                if "DELIMITER" in line.upper():
-                    delimiter = line.split(" ")[1].strip()
-                else:
-                    if delimiter in line.upper():
-                        if delimiter != ";":
-                            stmt += line.replace(delimiter, ";")
-                        else:
-                            stmt += line
-
-                        print(stmt)
-                        cursor.execute(stmt)
-                        stmt = ""
-                    else:
-                        stmt += line
-
-        # Commit after every SQL script
-        conn.commit()
+        if len(stage) == 1:
+            groups = [[stage[0][0]]]
+        else:
+            links = dict() if relax_checks else _table_links(cursor, db_name)
+            groups = _group_scripts(stage, links)
+
+        if len(groups) > 1:
+            reports.extend(_load_in_parallel(groups, db_name, jobs, echo, relax_checks))
+            continue
+        for script in groups[0]:
+            print_str = f"Executing {script}:"
+            print_aux_len = len(print_str) + 2
+
+            print("=" * print_aux_len)
+            print(f" {print_str} ")
+            print("=" * print_aux_len, "\n")
+
+            reports.append(execute_script(cursor, f"sql/{script}", echo))
+            print(f"  {reports[-1]}\n")
+
+            # Commit after every SQL script
+            conn.commit()
+
+    _print_summary(reports, time.perf_counter() - started_at, jobs)
 
     # after all database schema is created, we rename all columns and tables to be fully lowercase, this way we avoid any linux/windows weirdness.
     # there's a custom option when installing mysql server, it forces tablenames to be lowercase, maybe include that in the curriculum?
@@ -81,3 +108,327 @@ def create_database():
     # conn.commit()
     # Clean up when we're done
     cursor.close()
+
+
+class ScriptReport(Struct, frozen=True, gc=False):
+    script: str
+    statements: int
+    bytes_read: int
+    seconds: float
+    """Rows loaded from a data file (CSV, TSV or NDJSON), which has no statements"""
+    rows: Optional[int] = None
+
+    def executed(self) -> str:
+        if self.rows is not None:
+            return "{} rows".format(self.rows)
+        return "{} statements".format(self.statements)
+
+    def __str__(self) -> str:
+        return "{}, {:.1f} MiB in {:.2f}s ({:.1f} MiB/s)".format(
+            self.executed(),
+            self.bytes_read / 2**20,
+            self.seconds,
+            self.bytes_read / 2**20 / self.seconds if self.seconds else 0,
+        )
+
+
+# Executes a script's statements as they're read, sending consecutive INSERTs
+# in a single round trip, and reports the progress by the bytes read. Data
+# files are loaded into the table they're named after.
+def execute_script(
+    cursor, path: str, echo: bool = False, show_progress: bool = True
+) -> ScriptReport:
+    total = os.path.getsize(path)
+    progress = _Progress(total, show_progress)
+    if is_data_file(path):
+        rows = load_data_file(cursor, path, echo, progress.update)
+        progress.clear()
+        return ScriptReport(
+            os.path.basename(path),
+            0,
+            total,
+            time.perf_counter() - progress.started_at,
+            rows,
+        )
+
+    statements = 0
+    batch: List[str] = list()
+    batch_bytes = 0
+
+    def flush():
+        nonlocal batch, batch_bytes
+        if not batch:
+            return
+        cursor.execute(";\n".join(batch))
+        # Every statement of the batch has its own result
+        while cursor.nextset():
+            pass
+        batch = list()
+        batch_bytes = 0
+
+    for stmt, read in _read_statements(path):
+        statements += 1
+        if echo:
+            print(stmt)
+        if first_keyword(stmt) in ("insert", "replace"):
+            size = len(stmt.encode("utf-8"))
+            if batch_bytes + size > INSERT_BATCH_BYTES:
+                flush()
+            batch.append(stmt)
+            batch_bytes += size
+        else:
+            flush()
+            cursor.execute(stmt)
+        progress.update(read)
+    flush()
+    progress.clear()
+    return ScriptReport(
+        os.path.basename(path),
+        statements,
+        total,
+        time.perf_counter() - progress.started_at,
+    )
+
+
+# Yields the script's statements along with the bytes read so far
+def _read_statements(path: str) -> Iterator[Tuple[str, int]]:
+    splitter = SqlSplitter()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    read = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(SCRIPT_CHUNK_SIZE):
+            read += len(chunk)
+            for stmt in splitter.feed(decoder.decode(chunk)):
+                yield (stmt, read)
+        for stmt in splitter.feed(decoder.decode(b"", final=True)):
+            yield (stmt, read)
+    for stmt in splitter.close():
+        yield (stmt, read)
+
+
+class _Progress:
+    __slots__ = ["total", "started_at", "shown_at", "interactive"]
+
+    def __init__(self, total: int, show: bool = True):
+        self.total = total
+        self.started_at = self.shown_at = time.perf_counter()
+        self.interactive = show and sys.stdout.isatty()
+
+    def update(self, read: int):
+        now = time.perf_counter()
+        if not self.interactive or now - self.shown_at < 0.2:
+            return
+        self.shown_at = now
+        print(
+            "\r  {:5.1f}% ({:.1f}/{:.1f} MiB)".format(
+                read / self.total * 100 if self.total else 100,
+                read / 2**20,
+                self.total / 2**20,
+            ),
+            end="",
+            flush=True,
+        )
+
+    def clear(self):
+        if self.interactive:
+            print("\r\033[K", end="", flush=True)
+
+
+#
+# Parallel loading: scripts with anything but data statements (CREATE,
+# ALTER, triggers...) are run alone, in their order, as they may change what
+# the following scripts rely on. The data scripts between them are grouped
+# by the tables they touch, and the groups are loaded at the same time on
+# their own connections. Scripts in the same group keep their order.
+# Foreign key and unique checks stay on, so tables linked by a foreign key
+# are loaded by the same group, parents first as in the scripts' order, and
+# a script touching a table with triggers (which may read any other table)
+# puts its whole stage in a single group. With 'bootstrap_relax_checks' the groups
+# only follow the tables, and are loaded without the checks.
+#########################################################################
+
+# Statements that only change (or lock) the data of the tables they name
+DATA_KEYWORDS = frozenset(
+    ("insert", "replace", "update", "delete", "set", "lock", "unlock", "commit")
+)
+_RE_TABLE = r"(?:`[^`]+`|\w+)(?:\s*\.\s*(?:`[^`]+`|\w+))?"
+# An INSERT's target table, when it's followed by its values
+RE_INSERT_TARGET = re.compile(
+    r"\s*(?:INSERT|REPLACE)(?:\s+(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE))*"
+    r"\s+(?:INTO\s+)?(" + _RE_TABLE + r")"
+    r"\s*(?:\([^)]*\))?\s*(VALUES?\b|SET\b)?",
+    re.I,
+)
+# Any table a statement reads or writes (a few false positives in strings
+# only make scripts wait for others)
+RE_TABLES = re.compile(
+    r"\b(?:INTO|UPDATE|FROM|JOIN|TABLES?)\s+(" + _RE_TABLE + r")", re.I
+)
+
+
+def _table_name(name: str) -> str:
+    return name.rsplit(".", 1)[-1].strip().strip("`").casefold()
+
+
+# Returns the tables touched by the script, or None if it isn't a data script
+def _classify_script(path: str) -> Optional[Set[str]]:
+    if is_data_file(path):
+        return {data_file_table(path).casefold()}
+    tables: Set[str] = set()
+    for stmt, _ in _read_statements(path):
+        keyword = first_keyword(stmt)
+        if keyword is None:  # Executable comments, such as /*!40000 ... */
+            continue
+        if keyword not in DATA_KEYWORDS:
+            return None
+        m = RE_INSERT_TARGET.match(stmt)
+        if m is not None and m.group(2) is not None:
+            tables.add(_table_name(m.group(1)))
+        else:
+            tables.update(_table_name(t) for t in RE_TABLES.findall(stmt))
+    return tables
+
+
+# A stage's scripts, along with the tables they touch (None for a script that
+# runs alone)
+Stage = List[Tuple[str, Optional[Set[str]]]]
+
+
+# Splits the scripts in stages run one after the other: a script that runs
+# alone, or data scripts that may run at the same time
+def _plan_scripts(scripts: List[str]) -> List[Stage]:
+    stages: List[Stage] = list()
+    pending: Stage = list()
+    for script in scripts:
+        tables = _classify_script(f"sql/{script}")
+        if tables is None:
+            if pending:
+                stages.append(pending)
+                pending = list()
+            stages.append([(script, None)])
+        else:
+            pending.append((script, tables))
+    if pending:
+        stages.append(pending)
+    return stages
+
+
+# Returns the tables linked to each table of the database, by a foreign key
+# either way. Tables with triggers are linked to '*', every other table.
+def _table_links(cursor, db_name: str) -> Dict[str, Set[str]]:
+    links: Dict[str, Set[str]] = dict()
+    cursor.execute(
+        "SELECT TABLE_NAME, REFERENCED_TABLE_NAME "
+        "FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = %s AND REFERENCED_TABLE_NAME IS NOT NULL",
+        (db_name,),
+    )
+    for child, parent in cursor.fetchall():
+        (child, parent) = (child.casefold(), parent.casefold())
+        links.setdefault(child, set()).add(parent)
+        links.setdefault(parent, set()).add(child)
+    cursor.execute(
+        "SELECT EVENT_OBJECT_TABLE FROM INFORMATION_SCHEMA.TRIGGERS "
+        "WHERE TRIGGER_SCHEMA = %s",
+        (db_name,),
+    )
+    for (table,) in cursor.fetchall():
+        links.setdefault(table.casefold(), set()).add("*")
+    return links
+
+
+# Groups the stage's scripts that share a table, or a link between tables,
+# keeping their order in each group
+def _group_scripts(stage: Stage, links: Dict[str, Set[str]]) -> List[List[str]]:
+    stage_tables = set().union(*(tables or () for _, tables in stage))
+    groups: List[Tuple[List[int], Set[str]]] = list()
+    for i, (_, tables) in enumerate(stage):
+        tables = set(tables or ())
+        for table in list(tables):
+            linked = links.get(table, set())
+            tables |= stage_tables if "*" in linked else linked
+        indexes = [i]
+        for group in [g for g in groups if g[1] & tables]:
+            groups.remove(group)
+            indexes += group[0]
+            tables |= group[1]
+        groups.append((sorted(indexes), tables))
+    groups.sort(key=lambda g: g[0][0])
+    return [[stage[i][0] for i in g[0]] for g in groups]
+
+
+def _load_in_parallel(
+    groups: List[List[str]], db_name: str, jobs: int, echo: bool, relax_checks: bool
+) -> List[ScriptReport]:
+    print(
+        "Loading {} in parallel ({} connections)\n".format(
+            ", ".join(script for group in groups for script in group),
+            min(jobs, len(groups)),
+        )
+    )
+    with ThreadPoolExecutor(max_workers=min(jobs, len(groups))) as executor:
+        futures = [
+            executor.submit(_load_group, group, db_name, echo, relax_checks)
+            for group in groups
+        ]
+        (done, _) = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                executor.shutdown(cancel_futures=True)
+                raise future.exception()  # type: ignore
+    return [report for future in futures for report in future.result()]
+
+
+def _load_group(
+    group: List[str], db_name: str, echo: bool, relax_checks: bool
+) -> List[ScriptReport]:
+    conn = get_conn(client_flag=CLIENT.MULTI_STATEMENTS, local_infile=True)
+    reports: List[ScriptReport] = list()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"USE `{db_name}`")
+        if relax_checks:
+            # Only for this connection, the data is known to be consistent
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0, UNIQUE_CHECKS = 0")
+        for script in group:
+            reports.append(
+                execute_script(cursor, f"sql/{script}", echo, show_progress=False)
+            )
+            conn.commit()
+            print(f"  {script}: {reports[-1]}")
+        if relax_checks:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1, UNIQUE_CHECKS = 1")
+        cursor.close()
+    finally:
+        conn.close()
+    return reports
+
+
+def _print_summary(reports: List[ScriptReport], elapsed: float, jobs: int):
+    if not reports:
+        return
+    width = max(len(report.script) for report in reports)
+    print(
+        "\n{:<{}}  {:>18}  {:>9}  {:>9}".format(
+            "Script", width, "Executed", "MiB", "Seconds"
+        )
+    )
+    for report in reports:
+        print(
+            "{:<{}}  {:>18}  {:>9.1f}  {:>9.2f}".format(
+                report.script,
+                width,
+                report.executed(),
+                report.bytes_read / 2**20,
+                report.seconds,
+            )
+        )
+    print(
+        "{} scripts, {:.1f} MiB in {:.2f}s ({:.2f}s of scripts, {} connections at most)".format(
+            len(reports),
+            sum(report.bytes_read for report in reports) / 2**20,
+            elapsed,
+            sum(report.seconds for report in reports),
+            jobs,
+        )
+    )
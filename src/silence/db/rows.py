@@ -0,0 +1,47 @@
+from typing import Any, List, Sequence, Tuple, Type
+from functools import lru_cache
+
+from msgspec import Struct, defstruct
+
+#
+# SELECT results are fetched as plain tuples and turned into instances of a
+# Struct generated once per set of column names, which msgspec encodes as
+# JSON objects without building a dict for every row. This is a memory win,
+# not a speed one: benchmarks/bench_row_fetch.py (100k rows x 20 columns,
+# through PyMySQL's parsing) puts its peak memory ~13% under DictCursor's
+# (177 vs 205 MiB) while its rows/s stay within the noise of DictCursor's,
+# often a few percent under, as the driver's parsing dominates both.
+#########################################################################
+
+
+# Returns the column names of the cursor's last result. The description
+# doesn't have the columns' tables, so a repeated name gets its position as
+# a suffix instead of DictCursor's table prefix, e.g. 'name_3'.
+def column_names(cursor) -> Tuple[str, ...]:
+    if not cursor.description:
+        return tuple()
+    names: List[str] = list()
+    for i, column in enumerate(cursor.description):
+        name = column[0]
+        if name in names:
+            name = "{}_{}".format(name, i)
+        names.append(name)
+    return tuple(names)
+
+
+# Column names aren't always valid identifiers (e.g. 'COUNT(*)'), so the
+# fields get positional names and are renamed when encoded
+@lru_cache(maxsize=256)
+def row_type(columns: Tuple[str, ...]) -> Type[Struct]:
+    fields = ["c{}".format(i) for i in range(len(columns))]
+    return defstruct(
+        "Row",
+        [(name, Any) for name in fields],
+        rename=dict(zip(fields, columns)),
+        gc=False,
+    )
+
+
+def rows_to_structs(columns: Tuple[str, ...], rows: Sequence[tuple]) -> List[Struct]:
+    _type = row_type(columns)
+    return [_type(*row) for row in rows]
@@ -2,7 +2,7 @@ import logging
 
 from silence.__main__ import CONFIG
 from silence.logging.default_formatter import DefaultFormatter
-from silence.logging.handler import MaybeBlockingHandler
+from silence.logging.handler import MaybeBlockingHandler, start_listener
 
 logger = logging.getLogger("silence")
 log_lvl = logging.DEBUG if CONFIG.debug else logging.INFO
@@ -13,3 +13,15 @@ ch.setLevel(log_lvl)
 ch.setFormatter(DefaultFormatter())
 
 logger.addHandler(ch)
+
+
+# Moves the writes to the logging thread as configured, so it must be called
+# once the config has been loaded. Until then, records are written directly.
+def start_queue_logging():
+    _general = CONFIG.get().general
+    if _general.log_queue_size <= 0 or ch not in logger.handlers:
+        return
+    logger.removeHandler(ch)
+    logger.addHandler(
+        start_listener(ch, _general.log_queue_size, _general.log_overflow == "block")
+    )
@@ -1,6 +1,13 @@
 from silence.__main__ import CONFIG
 
-from logging import StreamHandler
+from typing import Optional
+from logging import Handler, LogRecord, StreamHandler, makeLogRecord, WARNING
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+
+import atexit
+import copy
+import os
 import threading
 import platform
 
@@ -31,3 +38,109 @@ class NoopLock:
 
     def __exit__(self, *args, **kwargs):
         pass
+
+
+#
+# Records are handed to a thread that formats and writes them, so logging
+# never waits for the terminal. The queue is bounded: once it's full, records
+# are dropped (and their number reported later) or, with the 'block' policy,
+# the caller waits up to a second for room before dropping them.
+#########################################################################
+
+
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, queue: Queue, block: bool):
+        super().__init__(queue)
+        self.block = block
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    # Only the message is merged here, as its arguments may change before the
+    # listener writes it (values that are expensive to turn into text should
+    # be logged through 'Truncated'). The exception is left for the listener's
+    # formatter, which formats and colours it off the caller's thread.
+    def prepare(self, record: LogRecord) -> LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: LogRecord):
+        try:
+            if self.block:
+                self.queue.put(record, timeout=1)
+            else:
+                self.queue.put_nowait(record)
+        except Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    # Returns the records dropped since the last call
+    def take_dropped(self) -> int:
+        if self.dropped == 0:
+            return 0
+        with self._dropped_lock:
+            (dropped, self.dropped) = (self.dropped, 0)
+        return dropped
+
+
+class _Listener(QueueListener):
+    # The records were already filtered by the queue handler's level, which is
+    # the one changed along with the logger's
+    def __init__(self, queue_handler: BoundedQueueHandler, handler: Handler):
+        super().__init__(queue_handler.queue, handler)
+        self.queue_handler = queue_handler
+
+    def handle(self, record: LogRecord):
+        dropped = self.queue_handler.take_dropped()
+        if dropped:
+            super().handle(
+                makeLogRecord(
+                    {
+                        "name": "silence",
+                        "levelno": WARNING,
+                        "levelname": "WARNING",
+                        "msg": "%d log records were dropped, the log queue was full",
+                        "args": (dropped,),
+                    }
+                )
+            )
+        super().handle(record)
+
+
+_LISTENER: Optional[_Listener] = None
+
+
+# Returns the handler to add to the logger, which hands the records to
+# 'handler' on its own thread
+def start_listener(handler: Handler, queue_size: int, block: bool) -> BoundedQueueHandler:
+    global _LISTENER
+    queue_handler = BoundedQueueHandler(Queue(queue_size), block)
+    queue_handler.setLevel(handler.level)
+    _LISTENER = _Listener(queue_handler, handler)
+    _LISTENER.start()
+    atexit.register(_stop_listener)
+    return queue_handler
+
+
+# Writes the records still queued
+def _stop_listener():
+    if _LISTENER is not None and _LISTENER._thread is not None:
+        _LISTENER.stop()
+
+
+# The listener's thread doesn't survive a fork, the child starts its own with
+# an empty queue (the parent writes the records queued before the fork)
+def _restart_listener_after_fork():
+    global _LISTENER
+    if _LISTENER is None:
+        return
+    queue_handler = _LISTENER.queue_handler
+    queue_handler.queue = Queue(queue_handler.queue.maxsize)
+    queue_handler.dropped = 0
+    queue_handler._dropped_lock = threading.Lock()
+    _LISTENER = _Listener(queue_handler, *_LISTENER.handlers)
+    _LISTENER.start()
+
+
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
@@ -0,0 +1,39 @@
+from typing import Any, Sized
+
+import reprlib
+
+#
+# Wraps large values (query results, bulk parameters) passed as arguments
+# to the logger. They're only turned into text if the record is written,
+# and then only their first items are, so logging them costs the same
+# whatever their size.
+#########################################################################
+
+_REPR = reprlib.Repr(
+    maxlevel=3,
+    maxtuple=8,
+    maxlist=8,
+    maxdict=8,
+    maxset=8,
+    maxstring=120,
+    maxother=120,
+)
+# Longest text of a value, after the items above have been cut
+MAX_LENGTH = 1000
+
+
+class Truncated:
+    __slots__ = ["value"]
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        text = _REPR.repr(self.value)
+        if len(text) > MAX_LENGTH:
+            text = text[: MAX_LENGTH - 3] + "..."
+        if isinstance(self.value, Sized) and not isinstance(self.value, str):
+            text += " ({} items)".format(len(self.value))
+        return text
+
+    __repr__ = __str__
@@ -0,0 +1,182 @@
+from silence.__main__ import CONFIG
+from silence.logging.default_logger import logger
+from silence.server.stats import RequestSample
+
+from typing import BinaryIO, Optional
+
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+
+from msgspec import Struct, json
+
+#
+# Structured access log: one JSON object per line for the requests to the
+# API, with the route template and endpoint that served them and how long
+# the database took. Successful requests can be sampled, errors are always
+# written. Lines are encoded into a buffer shared by the worker's runtime
+# threads and written by a background thread every
+# 'access_log_flush_interval' seconds (or sooner when the buffer fills up),
+# so requests never wait for the disk.
+#########################################################################
+
+# The buffer is written as soon as it reaches this size
+FLUSH_BYTES = 256 * 1024
+# Lines are dropped (and counted) while the buffer is over this size, if
+# the file can't keep up
+MAX_BUFFER_BYTES = 8 * 1024 * 1024
+
+
+class AccessRecord(Struct, frozen=True, gc=False, rename="camel"):
+    ts: float  # Unix time at which the response was sent
+    method: str
+    route: Optional[str]  # The endpoint's route template, e.g. '/users/$id'
+    endpoint: Optional[str]
+    status: int
+    bytes: int
+    latency_ms: float
+    db_ms: float
+
+
+class AccessLog:
+    __slots__ = [
+        "path",
+        "sample_rate",
+        "flush_interval",
+        "dropped",
+        "_file",
+        "_buffer",
+        "_lock",
+        "_flush_requested",
+        "_thread",
+    ]
+
+    path: str  # '-' is the standard output
+    sample_rate: float
+    flush_interval: float
+    dropped: int
+    _file: Optional[BinaryIO]
+    _buffer: bytearray
+    _lock: threading.Lock  # Guards the buffer and the dropped lines' count
+    _flush_requested: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, path: str, sample_rate: float, flush_interval: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._file = None
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    # Called by the runtime threads once the response has been sent
+    def record(self, method: str, sample: RequestSample, elapsed_ns: int):
+        if sample.status < 400 and random.random() >= self.sample_rate:
+            return
+        line = json.encode(
+            AccessRecord(
+                time.time(),
+                method,
+                sample.route,
+                sample.name,
+                sample.status,
+                sample.bytes_sent,
+                round(elapsed_ns / 1e6, 3),
+                round(sample.db_ns / 1e6, 3),
+            )
+        )
+        with self._lock:
+            if len(self._buffer) > MAX_BUFFER_BYTES:
+                self.dropped += 1
+                return
+            self._buffer += line
+            self._buffer += b"\n"
+            full = len(self._buffer) >= FLUSH_BYTES
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="silence-access-log", daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._flush_requested.set()
+
+    def _run(self):
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            data = self._take()
+            if data:
+                try:
+                    self._write(data)
+                except OSError as e:
+                    logger.error("Cannot write the access log: %s", e)
+
+    # Returns the buffered lines, and a line about the dropped ones if any
+    def _take(self) -> bytes:
+        with self._lock:
+            (data, self._buffer) = (bytes(self._buffer), bytearray())
+            (dropped, self.dropped) = (self.dropped, 0)
+        if dropped:
+            data += json.encode({"ts": time.time(), "dropped": dropped})
+            data += b"\n"
+        return data
+
+    # The flusher thread doesn't survive a fork, the child starts its own
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._thread = None
+
+    def _write(self, data: bytes):
+        if self._file is None:
+            if self.path == "-":
+                self._file = sys.stdout.buffer
+            else:
+                # Unbuffered, so a flush is written with as few calls as the
+                # OS allows. O_APPEND only keeps the lines of workers sharing
+                # the file from interleaving within each complete write call,
+                # the rest of a short write may land after another's lines.
+                self._file = open(self.path, "ab", buffering=0)
+        view = memoryview(data)
+        while view:
+            written = self._file.write(view)
+            view = view[written:]
+        self._file.flush()
+
+    # Writes what's still buffered when the worker exits
+    def close(self):
+        data = self._take()
+        try:
+            if data:
+                self._write(data)
+        except OSError:
+            pass
+
+
+_ACCESS_LOG: Optional[AccessLog] = None
+_ACCESS_LOG_LOCK = threading.Lock()
+
+
+# Returns the process' access log, or None if it's disabled
+def get_access_log() -> Optional[AccessLog]:
+    global _ACCESS_LOG
+    _server = CONFIG.get().server
+    if not _server.access_log:
+        return None
+    if _ACCESS_LOG is None:
+        with _ACCESS_LOG_LOCK:
+            if _ACCESS_LOG is None:
+                _ACCESS_LOG = AccessLog(
+                    _server.access_log,
+                    _server.access_log_sample_rate,
+                    _server.access_log_flush_interval,
+                )
+    return _ACCESS_LOG
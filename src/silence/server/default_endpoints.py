@@ -1,13 +1,16 @@
+from silence.auth.passwords import check_password, hash_password
 from silence.auth.tokens import create_token
 from silence.db import dal
 from silence.sql.builder import get_login_query, get_register_user_query
 from silence.__main__ import CONFIG
-from silence.exceptions import HTTPError
+from silence.exceptions import DatabaseError, HTTPError, ServerErrorWrapper
 from silence.logging.default_logger import logger
 from silence.logging import utils as log_utils
 
 from flask import jsonify, request
-from werkzeug.security import check_password_hash, generate_password_hash
+from pymysql.constants import ER
+from pymysql.err import IntegrityError
+from pypika import Parameter
 
 from silence.sql.tables import DATABASE_SCHEMA
 
@@ -49,7 +52,7 @@ def login():
     if PASSWORD_FIELD not in user:
         raise HTTPError(500, f"The user has no attribute '{PASSWORD_FIELD}'")
 
-    password_ok = check_password_hash(user[PASSWORD_FIELD], password)
+    password_ok = busy_to_http(check_password, user[PASSWORD_FIELD], password)
     if not password_ok:
         logger.debug("Incorrect password")
         raise HTTPError(400, "The user or the password are not correct")
@@ -68,7 +71,7 @@ def login():
     if CONFIG.debug:
         logger.info(log_utils.format_custom_record("api", "yellow", f"PARAMS {form}"))
 
-    token = create_token(user)
+    token = create_token(*get_token_claims(user, USERS_TABLE, ROLE_FIELD))
     del user[PASSWORD_FIELD]
     res = {"sessionToken": token, "user": user}
     return jsonify(res), 200
@@ -96,19 +99,22 @@ def register():
     del form_debug[PASSWORD_FIELD]
     logger.debug(f"Register request with data {form_debug}")
 
-    # Ensure that the identifier is unique
-    login_q = get_login_query(USERS_TABLE, IDENTIFIER_FIELD, username)
-    other_users = dal.api_safe_query(login_q)
-
-    if other_users:
-        logger.debug("The identifier %s already exists", username)
-        raise HTTPError(
-            400, f"There already exists another user with that {IDENTIFIER_FIELD}"
-        )
+    # The identifier must be unique, which the database enforces by itself
+    # if the column has a unique key
+    table = DATABASE_SCHEMA.get_table(USERS_TABLE)
+    identifier = DATABASE_SCHEMA.get_field(USERS_TABLE, IDENTIFIER_FIELD)
+    assert table is not None and identifier is not None
+    if not identifier.unique:
+        login_q = get_login_query(USERS_TABLE, IDENTIFIER_FIELD, username)
+        if dal.api_safe_query(login_q):
+            logger.debug("The identifier %s already exists", username)
+            raise HTTPError(
+                400, f"There already exists another user with that {IDENTIFIER_FIELD}"
+            )
 
     # Create the user object, replacing the password with the hashed one
     user = dict(form)
-    user[PASSWORD_FIELD] = generate_password_hash(password)
+    user[PASSWORD_FIELD] = busy_to_http(hash_password, password)
 
     # Assign a default active status, if the activity check is on and none has
     # been provided
@@ -120,12 +126,27 @@ def register():
     # we assume that the user knows what they're doing and submits the
     # appropriate fields. Otherwise, the DB will just complain.
     register_q = get_register_user_query(USERS_TABLE, user)
-    dal.api_safe_update(register_q)
 
-    # Fetch the newly created user from the DB (some fields may have been)
-    # automatically generated, like its ID
-    # It should now exist
-    user = dal.api_safe_query(login_q)[0]
+    # Fetch the newly created user from the DB in the same transaction (some
+    # fields may have been automatically generated, like its ID), by the ID
+    # generated by the INSERT if there's one
+    pk = DATABASE_SCHEMA.get_field(USERS_TABLE, table.primary_key_field)
+    if pk is not None and pk.auto_increment:
+        fetch_q = get_login_query(USERS_TABLE, pk.name, Parameter("%s"))
+        fetch_params = None
+    else:
+        fetch_q = get_login_query(USERS_TABLE, IDENTIFIER_FIELD, Parameter("%s"))
+        fetch_params = (username,)
+
+    try:
+        user = dal.update_and_fetch(register_q, None, fetch_q, fetch_params)[0]
+    except DatabaseError as exc:
+        if is_duplicate_entry(exc):
+            logger.debug("The identifier %s already exists", username)
+            raise HTTPError(
+                400, f"There already exists another user with that {IDENTIFIER_FIELD}"
+            )
+        raise
 
     # If we've reached here the register is successful, generate a session token
     # and return it with the logged user's info
@@ -134,7 +155,7 @@ def register():
     if CONFIG.debug:
         logger.info(log_utils.format_custom_record("api", "yellow", f"PARAMS {form}"))
 
-    token = create_token(user)
+    token = create_token(*get_token_claims(user, USERS_TABLE, ROLE_FIELD))
     del user[PASSWORD_FIELD]
     res = {"sessionToken": token, "user": user}
     return jsonify(res), 200
@@ -147,14 +168,13 @@ def register():
 # Transforms the received dict of fields into a filtered one that shares
 # the same capitalization with the DB columns
 def filter_fields_db(data, table_name):
-    cols = DATABASE_SCHEMA.get_table(table_name)
-    assert cols is not None
+    assert DATABASE_SCHEMA.get_table(table_name) is not None
     res = {}
 
     for field, value in data.items():
-        for col in cols.fields:
-            if field.casefold() == col.name.casefold():
-                res[col.name] = value
+        col = DATABASE_SCHEMA.get_field(table_name, field)
+        if col is not None:
+            res[col.name] = value
 
     return res
 
@@ -162,14 +182,36 @@ def filter_fields_db(data, table_name):
 # Returns a given column name with the correct capitalization for its table
 # Raises a ValueError if it can't be found in the given table
 def col_correct_case(col_name, table_name):
-    cols = DATABASE_SCHEMA.get_table(table_name)
-    assert cols is not None
+    col = DATABASE_SCHEMA.get_field(table_name, col_name)
+    if col is None:
+        raise ValueError(
+            f"The column {col_name} could not be found in table {table_name}"
+        )
+    return col.name
+
+
+# Runs a password hash or check, turning the rejection of the pool (when too
+# many of them are pending) into its 503 response
+def busy_to_http(fn, *args):
+    try:
+        return fn(*args)
+    except ServerErrorWrapper as exc:
+        raise HTTPError(exc._error.code, exc._error.reason) from exc
+
+
+# Whether a write failed because it violates a primary or unique key
+def is_duplicate_entry(exc: DatabaseError) -> bool:
+    cause = exc.__cause__
+    return isinstance(cause, IntegrityError) and cause.args[0] == ER.DUP_ENTRY
 
-    for col in cols.fields:
-        if col.name.casefold() == col_name.casefold():
-            return col
 
-    raise ValueError(f"The column {col_name} could not be found in table {table_name}")
+# Returns what the session token carries: the user's primary key and role
+def get_token_claims(user, table_name, role_field):
+    table = DATABASE_SCHEMA.get_table(table_name)
+    assert table is not None
+    if not table.primary_key_field:
+        raise HTTPError(500, f"The table {table_name} has no primary key")
+    return (user[table.primary_key_field], user.get(role_field) if role_field else None)
 
 
 # Returns the login table and fields as specified in the settings,
@@ -1,5 +1,13 @@
-from typing import List, Optional, Tuple
+from silence.sql import SqlOps, get_sql_op
+from silence.sql.converter import extract_params, silence_to_mysql
+from silence.sql.rewriter import get_result_columns
+from silence.sql.tables import DATABASE_SCHEMA
+
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
 from enum import StrEnum
+from uuid import UUID
+
+import re
 
 from msgspec import Struct, field
 
@@ -11,74 +19,300 @@ class HttpMethod(StrEnum):
     DELETE = "delete"
 
 
+class ParamType(StrEnum):
+    INT = "int"
+    STR = "str"
+    UUID = "uuid"
+
+
+# Returns the captured value, or None if the URL segment doesn't match the type
+def _capture_int(segment: str) -> Optional[int]:
+    return int(segment) if segment.isascii() and segment.isdigit() else None
+
+
+def _capture_uuid(segment: str) -> Optional[str]:
+    try:
+        return str(UUID(segment))
+    except ValueError:
+        return None
+
+
+def _capture_str(segment: str) -> Optional[str]:
+    return segment
+
+
+_CAPTURES: Dict[ParamType, Callable[[str], Any]] = {
+    ParamType.INT: _capture_int,
+    ParamType.UUID: _capture_uuid,
+    ParamType.STR: _capture_str,
+}
+
+# Route parameters are written as '$name' or '$name:type', untyped ones
+# are integers as they've always been
+RE_ROUTE_PARAM = re.compile(r"^\$(\w+)(?::(\w+))?$")
+RE_INSERT_VALUES = re.compile(
+    r"^\s*INSERT\s+INTO\s+`?(?P<table>\w+)`?\s*\((?P<columns>[^()]*)\)"
+    r"\s*VALUES\s*\((?P<values>[^()]*)\)\s*;?\s*$",
+    re.I,
+)
+RE_PARAM = re.compile(r"\$\w+")
+
+
 """
-To achieve near constant time pattern matching, is assumed that paterns are
-always at the end of the route, they are always integers and the last
-part of a static route must contain characters.
+Routes are stored in a trie with one level per URL segment. Static segments
+are matched with a dict lookup and take precedence over parameters, which
+are tried in the order int, uuid, str. Matching is linear in the number of
+segments unless a branch has to be backtracked.
 """
 
 
-class RoutePattern(Struct, forbid_unknown_fields=True, omit_defaults=True):
-    url_parts: Tuple[str, ...] = field(default_factory=tuple)
-    method: HttpMethod = field(default=HttpMethod.GET)
-    parameterized: bool = field(default=False)
-    parameter_name: Optional[str] = field(default=None)
+class _RouteNode:
+    __slots__ = ["static", "params", "endpoints"]
 
-    @staticmethod
-    def new_from_parser(route: str, method: HttpMethod) -> RoutePattern:
-        parts: Tuple[str, ...] = tuple(
-            part.casefold() for part in route.split("/") if part != ""
-        )
-        if len(parts) == 0:
-            return RoutePattern(tuple(), method, False, None)
-        match "$" in parts[-1]:
-            case True:
-                return RoutePattern(parts[:-1], method, True, parts[-1])
-            case False:
-                return RoutePattern(parts, method, False, None)
+    static: Dict[str, _RouteNode]  # Keyed by the casefolded segment
+    params: List[Tuple[ParamType, Callable[[str], Any], _RouteNode]]
+    endpoints: Dict[HttpMethod, Tuple[str, Tuple[str, ...]]]  # (name, param names)
 
-    @staticmethod
-    def new_from_request(
-        route: str, method: HttpMethod
-    ) -> Tuple[RoutePattern, Optional[int]]:
-        parts: Tuple[str, ...] = tuple(
-            part.casefold() for part in route.split("/") if part != ""
-        )
-        """
-        Decide whether the route is parameterized or not by checking
-        if the final part can be serialized an an integer
-        """
-        if len(parts) == 0:
-            return (RoutePattern(tuple(), method, False, None), None)
-        match parts[-1].isnumeric():
-            case True:
-                return (RoutePattern(parts[:-1], method, True, None), int(parts[-1]))
-            case False:
-                return (RoutePattern(parts, method, False, None), None)
-
-    def __eq__(self, value: object) -> bool:
-        if not isinstance(value, RoutePattern):
-            raise Exception()
-        return (
-            self.url_parts == value.url_parts
-            and self.method == value.method
-            and self.parameterized == value.parameterized
-        )
+    def __init__(self):
+        self.static = dict()
+        self.params = list()
+        self.endpoints = dict()
+
+    def param_child(self, param_type: ParamType) -> _RouteNode:
+        for _type, _, child in self.params:
+            if _type == param_type:
+                return child
+        child = _RouteNode()
+        self.params.append((param_type, _CAPTURES[param_type], child))
+        order = list(_CAPTURES)
+        self.params.sort(key=lambda item: order.index(item[0]))
+        return child
+
+
+class RouteTrie:
+    __slots__ = ["_root"]
+
+    _root: _RouteNode
+
+    def __init__(self):
+        self._root = _RouteNode()
+
+    """
+    If there's already an endpoint for the same method and route shape
+    (regardless of the parameters' names) nothing is inserted and its
+    name is returned.
+    """
+
+    def insert(self, route: str, method: HttpMethod, name: str) -> Optional[str]:
+        node = self._root
+        names: List[str] = list()
+        for segment in route.split("/"):
+            if segment == "":
+                continue
+            m = RE_ROUTE_PARAM.match(segment)
+            if m is None:
+                node = node.static.setdefault(segment.casefold(), _RouteNode())
+                continue
+            try:
+                param_type = ParamType((m.group(2) or ParamType.INT).casefold())
+            except ValueError:
+                raise Exception(
+                    "Unknown type '{}' for the parameter ${} in route {}, "
+                    "expected one of: {}.".format(
+                        m.group(2), m.group(1), route, ", ".join(ParamType)
+                    )
+                )
+            names.append(m.group(1))
+            node = node.param_child(param_type)
+        if method in node.endpoints:
+            return node.endpoints[method][0]
+        node.endpoints[method] = (name, tuple(names))
+        return None
+
+    # Returns the endpoint's name and the captured parameters
+    def match(
+        self, path: str, method: HttpMethod
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        # Walk down greedily, which is enough unless a branch that was
+        # taken turns out to be a dead end and another one could match
+        node = self._root
+        values: List[Any] = list()
+        branched = False
+        for segment in path.split("/"):
+            if segment == "":
+                continue
+            child = node.static.get(segment)
+            if child is None and node.static:
+                child = node.static.get(segment.casefold())
+            if child is not None:
+                branched = branched or bool(node.params)
+                node = child
+                continue
+            for _, capture, child in node.params:
+                value = capture(segment)
+                if value is not None:
+                    branched = branched or len(node.params) > 1
+                    values.append(value)
+                    node = child
+                    break
+            else:
+                node = None
+                break
+
+        found = node.endpoints.get(method) if node is not None else None
+        if found is None and branched:
+            values.clear()
+            segments = [segment for segment in path.split("/") if segment != ""]
+            found = self._match(self._root, segments, 0, method, values)
+        if found is None:
+            return None
+        name, names = found
+        return (name, dict(zip(names, values)))
+
+    def _match(
+        self,
+        node: _RouteNode,
+        segments: List[str],
+        i: int,
+        method: HttpMethod,
+        values: List[Any],
+    ) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        if i == len(segments):
+            return node.endpoints.get(method)
+        segment = segments[i]
+        child = node.static.get(segment) or node.static.get(segment.casefold())
+        if child is not None:
+            found = self._match(child, segments, i + 1, method, values)
+            if found is not None:
+                return found
+        for _, capture, child in node.params:
+            value = capture(segment)
+            if value is None:
+                continue
+            values.append(value)
+            found = self._match(child, segments, i + 1, method, values)
+            if found is not None:
+                return found
+            values.pop()
+        return None
 
 
 class EndpointDefinition(Struct, forbid_unknown_fields=True, omit_defaults=True):
     route: str
     method: HttpMethod
-    query: Optional[str]
+    query: Optional[str] = field(default=None)
     description: Optional[str] = field(default=None)
     request_body_params: List[str] = field(default_factory=list)
     required_auth: bool = field(default=False)
     allowed_roles: List[str] = field(default_factory=list)
+    """Stream the SELECT's rows as they are read instead of buffering the whole result"""
+    stream: bool = field(default=False)
+    """Take a JSON array of rows and run the query once per row in a single transaction"""
+    bulk: bool = field(default=False)
+    """
+    Statements run in order inside a single transaction instead of 'query', each
+    one can use the ID generated by the last INSERT as $lastId
+    """
+    queries: List[str] = field(default_factory=list)
     _generated: bool = field(default=False)
 
 
-class EndpointWithValue(
-    Struct, frozen=True, forbid_unknown_fields=True, omit_defaults=True
-):
-    endpoint: EndpointDefinition
-    param_value: Optional[int]
+"""
+An endpoint's query, compiled once when the routes are loaded so that
+serving a request doesn't need to parse it again.
+"""
+
+
+class CompiledQuery(Struct, frozen=True, gc=False):
+    sql: str  # The query with MySQL-style placeholders
+    op: SqlOps
+    params: Tuple[str, ...]  # Names of the placeholders' values, in order
+    result_columns: Optional[FrozenSet[str]]
+    tables: Optional[FrozenSet[str]]  # Tables read or written, if known
+    auto_id: bool = False  # An INSERT into a table with an auto_increment key
+    id_param: Optional[int] = None  # Position in 'params' of an INSERT's key
+
+    @staticmethod
+    def new_from_endpoint(endpoint: EndpointDefinition) -> Optional[CompiledQuery]:
+        if endpoint.query is None:
+            return None
+        (auto_id, id_param) = _inserted_key(endpoint.query)
+        return CompiledQuery(
+            silence_to_mysql(endpoint.query),
+            get_sql_op(endpoint.query),
+            tuple(extract_params(endpoint.query)),
+            get_result_columns(endpoint.query),
+            DATABASE_SCHEMA.referenced_tables(endpoint.query),
+            auto_id,
+            id_param,
+        )
+
+    # Returns the values for the query's placeholders, missing ones are NULL
+    def bind(self, values: Mapping[str, Any]) -> Tuple[Any, ...]:
+        return tuple(values.get(param) for param in self.params)
+
+
+# For an 'INSERT INTO t (columns) VALUES (values)' into a table with a single
+# column primary key, returns whether the key is auto_increment and the
+# position among the query's parameters of the value given to it, if it's
+# given one. Any other statement returns (False, None), their IDs can't be
+# told.
+def _inserted_key(sql: str) -> Tuple[bool, Optional[int]]:
+    match = RE_INSERT_VALUES.match(sql)
+    if match is None:
+        return (False, None)
+    table = DATABASE_SCHEMA.get_table(match["table"])
+    if table is None or len(table.primary_key_fields) > 1:
+        return (False, None)
+    key = DATABASE_SCHEMA.get_field(table.name, table.primary_key_field)
+    if key is None:
+        return (False, None)
+    auto_id = bool(key.auto_increment)
+
+    columns = [
+        column.strip(" \t\n`").casefold() for column in match["columns"].split(",")
+    ]
+    values = [value.strip() for value in match["values"].split(",")]
+    if len(columns) != len(values) or RE_PARAM.search(match["columns"]):
+        return (False, None)
+    position = 0
+    for column, value in zip(columns, values):
+        if column == key.name.casefold():
+            if RE_PARAM.fullmatch(value):
+                return (auto_id, position)
+            if value.upper() in ("NULL", "DEFAULT"):
+                return (auto_id, None)
+            return (False, None)
+        position += len(RE_PARAM.findall(value))
+    return (auto_id, None)
+
+
+"""
+The compiled statements of an endpoint with several queries, which run on
+the same connection and are committed together.
+"""
+
+
+class CompiledTransaction(Struct, frozen=True, gc=False):
+    statements: Tuple[CompiledQuery, ...]
+    tables: Optional[FrozenSet[str]]  # Tables written by any statement, if known
+
+    @staticmethod
+    def new_from_endpoint(endpoint: EndpointDefinition) -> CompiledTransaction:
+        statements = tuple(
+            CompiledQuery(
+                silence_to_mysql(query),
+                get_sql_op(query),
+                tuple(extract_params(query)),
+                None,
+                DATABASE_SCHEMA.referenced_tables(query),
+            )
+            for query in endpoint.queries
+        )
+        tables: Optional[FrozenSet[str]] = frozenset()
+        for statement in statements:
+            if statement.tables is None:
+                tables = None
+                break
+            tables |= statement.tables  # type: ignore
+        return CompiledTransaction(statements, tables)
@@ -12,11 +12,12 @@ import re
 from msgspec import toml
 
 
-# Entry point for the CLI command
-def load_routes():
+# Entry point for the CLI command, server workers load the routes again
+# without dumping the auto generated endpoints
+def load_routes(dump_auto_endpoints: bool = True):
     load_fs_endpoints()
     if CONFIG.get().general.auto_endpoints:
-        generate_db_endpoints()
+        generate_db_endpoints(dump_auto_endpoints)
     if CONFIG.get().server.summary_endpoint:
         ENDPOINTS.put(
             "_generated_summary",
@@ -27,30 +28,39 @@ def load_routes():
                 query=None,
             ),
         )
+    ENDPOINTS.compile_queries()
 
 
 # Get the entities from the database and the existing user endpoints and
 # create CRUD endpoint files (json) for the remaining o  nes.
-def generate_db_endpoints():
-    # Load the database's schema
-    DATABASE_SCHEMA.load_tables()
-
-    # Remove the folder if it exists and create it again
+def generate_db_endpoints(dump: bool = True):
     auto_dir = getcwd() + "/endpoints/_auto"
 
-    logger.debug("Creating directory %s", auto_dir)
-    try:
-        makedirs(auto_dir)
-    except OSError:
-        logger.debug("Directory already exists.")
+    # Load the database's schema, from the snapshot kept along with the
+    # auto generated endpoints if the schema hasn't changed since
+    if CONFIG.get().general.schema_cache:
+        DATABASE_SCHEMA.load_tables_cached(auto_dir + "/_schema.msgpack")
+    else:
+        DATABASE_SCHEMA.load_tables()
+
+    # Create the folder if it doesn't exist
+    if dump:
+        logger.debug("Creating directory %s", auto_dir)
+        try:
+            makedirs(auto_dir)
+        except OSError:
+            logger.debug("Directory already exists.")
 
     # Generate endpoints for each table
     for table in DATABASE_SCHEMA.tables:
         endpoints: Dict[str, EndpointDefinition] = dict()
-        logger.info("Generating endpoints for %s", table.name)
+        (logger.info if dump else logger.debug)(
+            "Generating endpoints for %s", table.name
+        )
 
         route_one = "/{}/${}".format(table.name.casefold(), table.primary_key_field)
         route_all = "/{}".format(table.name.casefold())
+        route_bulk = "/{}/_bulk".format(table.name.casefold())
 
         # endpoints_schema = [
         #     ("GET", "getAll", route_all),
@@ -67,6 +77,12 @@ def generate_db_endpoints():
         #  ('PUT', 'update', '/departments/$departmentId'),
         #  ('DELETE', 'delete', '/departments/$departmentId')]
 
+        # Every write endpoint has a bulk variant, which takes a JSON array of
+        # rows (including their primary key to update or delete them):
+        # [('POST', 'bulkCreate', '/departments/_bulk'),
+        #  ('PUT', 'bulkUpdate', '/departments/_bulk'),
+        #  ('DELETE', 'bulkDelete', '/departments/_bulk')]
+
         for method in HttpMethod:
             match method:
                 case HttpMethod.GET if table.is_view:
@@ -129,6 +145,23 @@ def generate_db_endpoints():
                         ),
                         copy_dict=endpoints,
                     )
+                    ENDPOINTS.put(
+                        "_generated_{}_bulkCreate".format(table.name.casefold()),
+                        EndpointDefinition(
+                            route_bulk,
+                            HttpMethod.POST,
+                            "INSERT INTO {} {} VALUES {}".format(
+                                table.name,
+                                params_to_string(table.fields),
+                                params_to_string(table.fields, "$"),
+                            ),
+                            "Creates new entries in '{}'.".format(table.name),
+                            [field.name for field in table.fields],
+                            bulk=True,
+                            _generated=True,
+                        ),
+                        copy_dict=endpoints,
+                    )
 
                 case HttpMethod.PUT if not table.is_view:
                     ENDPOINTS.put(
@@ -152,6 +185,26 @@ def generate_db_endpoints():
                         ),
                         copy_dict=endpoints,
                     )
+                    ENDPOINTS.put(
+                        "_generated_{}_bulkUpdate".format(table.name.casefold()),
+                        EndpointDefinition(
+                            route_bulk,
+                            HttpMethod.PUT,
+                            "UPDATE {} SET {} WHERE {} = ${}".format(
+                                table.name,
+                                params_to_string(table.fields, is_update=True),
+                                table.primary_key_field,
+                                table.primary_key_field,
+                            ),
+                            "Updates existing entries in '{}' by their primary keys.".format(
+                                table.name
+                            ),
+                            [field.name for field in table.fields],
+                            bulk=True,
+                            _generated=True,
+                        ),
+                        copy_dict=endpoints,
+                    )
 
                 case HttpMethod.DELETE if not table.is_view:
                     ENDPOINTS.put(
@@ -173,13 +226,32 @@ def generate_db_endpoints():
                         ),
                         copy_dict=endpoints,
                     )
+                    ENDPOINTS.put(
+                        "_generated_{}_bulkDelete".format(table.name.casefold()),
+                        EndpointDefinition(
+                            route_bulk,
+                            HttpMethod.DELETE,
+                            "DELETE FROM {} WHERE {} = ${}".format(
+                                table.name,
+                                table.primary_key_field,
+                                table.primary_key_field,
+                            ),
+                            "Deletes existing entries in '{}' by their primary keys.".format(
+                                table.name
+                            ),
+                            [table.primary_key_field],
+                            bulk=True,
+                            _generated=True,
+                        ),
+                        copy_dict=endpoints,
+                    )
 
         # Create *all* the .js files for the API.
         # TODO: FIX THIS
         # generate_API_file_for_endpoints(endpoints_to_js, table.name, pk)
 
         # Dump the auto generated endpoints to a toml file
-        if endpoints:
+        if dump and endpoints:
             with open(auto_dir + f"/{table.name}.toml", "wb") as f:
                 f.write(toml.encode(endpoints))
 
@@ -277,9 +349,8 @@ def load_fs_endpoints():
                         "be marked as _generated."
                     )
                 for name, endpoint in endpoints.items():
-                    endpoint.route = (
-                        endpoint.route.casefold()
-                    )  # Make routes case insensitive
+                    # Routes are matched case insensitively by the router,
+                    # the parameters' names keep the case used in the query
                     ENDPOINTS.put(name, endpoint, ignore_if_exists=False)
             except Exception as e:
                 e.add_note("Cannot deserialize endpoint definition.")
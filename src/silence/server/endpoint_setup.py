@@ -3,21 +3,24 @@ from silence import sql as SQL
 from silence.sql import get_sql_op, SqlOps
 from silence.__main__ import CONFIG
 from silence.server.endpoint import (
+    CompiledQuery,
+    CompiledTransaction,
     EndpointDefinition,
-    EndpointWithValue,
     HttpMethod,
-    RoutePattern,
+    RouteTrie,
 )
 from silence.sql.tables import DATABASE_SCHEMA
 from silence.utils.min_type import Min
 from silence.auth.tokens import check_token
+from silence.auth.users import get_session_user
 from silence.logging.default_logger import logger
 from silence.logging import utils as log_utils
-from silence.sql.converter import silence_to_mysql
+from silence.sql.converter import extract_params
+from silence.sql.rewriter import QueryArgs, push_down_query_args
 from silence.server import serve as server_manager
 from silence.exceptions import TokenError, ServerError, ServerErrorWrapper
 
-from typing import List, Optional, Dict, TypeAlias
+from typing import Any, Optional, Dict, Tuple, TypeAlias, Union
 
 import logging
 import re
@@ -34,40 +37,48 @@ OP_VERBS = {
 
 Endpoints: TypeAlias = Dict[str, EndpointDefinition]
 
+Compiled: TypeAlias = Union[CompiledQuery, CompiledTransaction]
+
+# The endpoint's name and definition, its compiled query (or queries) and the
+# values of the route's parameters
+RouteMatch: TypeAlias = Tuple[
+    str, EndpointDefinition, Optional[Compiled], Dict[str, Any]
+]
+
 
 class EndpointsGlobal:
-    __slots__ = ["_endpoints", "_static_routes_cache", "_parameterized_routes_cache"]
+    __slots__ = ["_endpoints", "_compiled", "_routes"]
 
     _endpoints: Dict[str, EndpointDefinition]
+    _compiled: Dict[str, Compiled]
 
-    _static_routes_cache: Dict[RoutePattern, str]
-    _parameterized_routes_cache: Dict[RoutePattern, str]
+    _routes: RouteTrie
 
     def __init__(self):
         self._endpoints = dict()
-        self._static_routes_cache = dict()
-        self._parameterized_routes_cache = dict()
+        self._compiled = dict()
+        self._routes = RouteTrie()
 
     def find_matching_route(
         self, route: str, method: HttpMethod
-    ) -> Optional[EndpointWithValue]:
-        (route_pattern, param_value) = RoutePattern.new_from_request(route, method)
-        try:
-            match route_pattern.parameterized:
-                case True:
-                    return EndpointWithValue(
-                        self._endpoints[
-                            self._parameterized_routes_cache[route_pattern]
-                        ],
-                        param_value,
-                    )
-                case False:
-                    return EndpointWithValue(
-                        self._endpoints[self._static_routes_cache[route_pattern]],
-                        None,
-                    )
-        except KeyError:
+    ) -> Optional[RouteMatch]:
+        found = self._routes.match(route, method)
+        if found is None:
             return None
+        (name, params) = found
+        return (name, self._endpoints[name], self._compiled.get(name), params)
+
+    # Compiles the endpoints' queries, must be called once the database's
+    # schema has been loaded, as it's used to know the results' columns
+    def compile_queries(self):
+        for name, endpoint in self._endpoints.items():
+            compiled = (
+                CompiledTransaction.new_from_endpoint(endpoint)
+                if endpoint.queries
+                else CompiledQuery.new_from_endpoint(endpoint)
+            )
+            if compiled is not None:
+                self._compiled[name] = compiled
 
     """
     An endpoint will already exist if there is another one that has the same identifier or
@@ -111,6 +122,43 @@ class EndpointsGlobal:
                     )
                 else:
                     return
+        if endpoint.query is not None and endpoint.queries:
+            raise Exception(
+                "The endpoint '{}' has both 'query' and 'queries', only one of them can be set.".format(
+                    name
+                )
+            )
+        # Checks that the queries' parameters can be obtained from the URL
+        # (and the request body, for writes and transactions)
+        url_params = extract_params(endpoint.route)
+        body_params = url_params + endpoint.request_body_params
+        if endpoint.query is not None:
+            check_params_match(
+                extract_params(endpoint.query),
+                (
+                    url_params
+                    if get_sql_op(endpoint.query) in (SqlOps.SELECT, SqlOps.DELETE)
+                    else body_params
+                ),
+                endpoint.route,
+            )
+        for query in endpoint.queries:
+            check_params_match(
+                extract_params(query), body_params + ["lastId"], endpoint.route
+            )
+            sql_op = get_sql_op(query)
+            if sql_op not in OP_VERBS:
+                logging.warning(
+                    "Cannot statically check {}'s query {}, unsupported query verb.".format(
+                        name, query
+                    )
+                )
+            elif sql_op != SqlOps.SELECT and endpoint.method == HttpMethod.GET:
+                raise Exception(
+                    "The endpoint '{}' uses the GET method but its query {} "
+                    "writes to the database.".format(name, query)
+                )
+
         # Checks whether the SQL operation and the HTTP verb match
         if endpoint.query is not None:
             sql_op = get_sql_op(endpoint.query)
@@ -130,21 +178,26 @@ class EndpointsGlobal:
                     )
                 )
 
+        # Routes that only differ in case or in their parameters' names
+        # are also the same route
+        existing = self._routes.insert(endpoint.route, endpoint.method, name)
+        if existing is not None:
+            if not ignore_if_exists and not self._endpoints[existing]._generated:
+                raise Exception(
+                    "There's a method with exactly the same route and method: {} and {}".format(
+                        endpoint, self._endpoints[existing]
+                    )
+                )
+            return
+
         if copy_dict is not None:
             copy_dict[name] = endpoint
         self._endpoints[name] = endpoint
-        # Cache the routes' pattern to speed up it's lookup
-        route_pattern = RoutePattern.new_from_parser(endpoint.route, endpoint.method)
-        match route_pattern.parameterized:
-            case True:
-                self._parameterized_routes_cache[route_pattern] = name
-            case False:
-                self._static_routes_cache[route_pattern] = name
 
 
 ENDPOINTS: EndpointsGlobal = EndpointsGlobal()
 
-RE_QUERY_PARAM = re.compile(r"^.*\$\w+/?$")
+RE_QUERY_PARAM = re.compile(r"^.*\$\w+(:\w+)?/?$")
 
 
 def print_endpoints():
@@ -172,11 +225,7 @@ def print_endpoints():
             ]
         )
         # Replace $param with <param>
-        route = re.sub(
-            r"\$(\w+)",
-            r"<\1>",
-            route_prefix + endpoint.route,
-        )
+        route = flaskify_url(route_prefix + endpoint.route)
 
         logger.info(
             "    · %s%s (%s)",
@@ -221,7 +270,8 @@ def setup_endpoint(endpoint: EndpointDefinition):
     url_params = extract_params(endpoint.route)
 
     # Get the required SQL operation
-    sql_op = get_sql_op(endpoint.query)
+    compiled = CompiledQuery.new_from_endpoint(endpoint)
+    sql_op = compiled.op
 
     # If it's a SELECT or a DELETE, m ake sure that all SQL params can be
     # obtained from the url
@@ -252,8 +302,8 @@ def setup_endpoint(endpoint: EndpointDefinition):
         if logged_user:
             request_url_params_dict["loggedId"] = get_current_user_id(logged_user_data)
 
-        # Convert the Silence-style placeholders in the SQL query to proper MySQL placeholders
-        query_string = silence_to_mysql(endpoint.query)
+        # The query already has proper MySQL placeholders
+        query_string = compiled.sql
 
         # Default outputs
         res = None
@@ -265,11 +315,19 @@ def setup_endpoint(endpoint: EndpointDefinition):
             url_pattern_params = tuple(
                 request_url_params_dict[param] for param in sql_params
             )
-            res = dal.api_safe_query(query_string, url_pattern_params)
-
-            # Filter these results according to the URL query string, if there is one
-            # Possible TO-DO: do this by directly editing the SQL query for extra efficiency
-            res = filter_query_results(res, request.args)
+            # Filter, sort and paginate in the query itself when possible, and
+            # otherwise filter the results according to the URL query string
+            rewritten = push_down_query_args(
+                query_string,
+                url_pattern_params,
+                QueryArgs(request.args),
+                compiled.result_columns,
+            )
+            if rewritten is not None:
+                res = dal.api_safe_query(*rewritten)
+            else:
+                res = dal.api_safe_query(query_string, url_pattern_params)
+                res = filter_query_results(res, request.args)
 
             # In our teaching context, it is safe to assume that if the URL ends
             # with a parameter and we have no results, we should return a 404 code
@@ -334,7 +392,7 @@ def get_logged_user():
 
     if token:
         try:
-            logged_user_data = check_token(token)
+            logged_user_data = get_session_user(check_token(token))
         except TokenError as exc:
             logger.debug("The user sent an invalid token: %s", str(exc))
 
@@ -392,7 +450,8 @@ def get_current_user_id(logged_user_data) -> Optional[int]:
     return userID
 
 
-# Implements filtering, ordering and paging using query strings
+# Implements filtering, ordering and paging using query strings, used when
+# the query can't be rewritten by 'silence.sql.rewriter'
 def filter_query_results(data, args):
     # Grab all parameters from the query string
     sort_param = args.get("_sort")
@@ -480,16 +539,17 @@ def check_auth_roles(auth_required, allowed_roles, method, route):
         )
 
 
-# Returns a list of $params in a SQL query or endpoint route,
-# without the $'s
-def extract_params(string) -> List[str]:
-    res = re.findall(r"\$\w+", string)
-    return [x[1:] for x in res]
-
-
-# Convers $url_param to <url_param>
+# Convers $url_param to <url_param> and $url_param:type to <type:url_param>
 def flaskify_url(url):
-    return re.sub(r"\$(\w+)", r"<\1>", url)
+    return re.sub(
+        r"\$(\w+)(?::(\w+))?",
+        lambda m: (
+            "<{}:{}>".format(m.group(2), m.group(1))
+            if m.group(2)
+            else "<{}>".format(m.group(1))
+        ),
+        url,
+    )
 
 
 # Checks whether all SQL params can be filled with the provided params
@@ -0,0 +1,158 @@
+from silence.__main__ import CONFIG
+from silence.server.static_response import StaticResponse
+
+from typing import Dict, FrozenSet, Hashable, Optional
+from collections import OrderedDict
+
+import threading
+import time
+
+#
+# In-process cache of the encoded responses of GET endpoints, with LRU
+# eviction, a time to live and a memory cap. Writes to a table drop the
+# cached results that read from it. Each server worker has its own cache,
+# so a write only invalidates the results cached by the worker that ran it,
+# the time to live bounds how stale the others can be.
+# Every table has a generation, bumped by the writes to it: a result read
+# before a write but put after its invalidation is discarded.
+#########################################################################
+
+
+class _Entry:
+    __slots__ = ["response", "tables", "expires_at"]
+
+    response: StaticResponse
+    tables: Optional[FrozenSet[str]]  # None if unknown, any write drops it
+    expires_at: float
+
+    def __init__(
+        self,
+        response: StaticResponse,
+        tables: Optional[FrozenSet[str]],
+        expires_at: float,
+    ):
+        self.response = response
+        self.tables = tables
+        self.expires_at = expires_at
+
+
+class ResultCache:
+    __slots__ = [
+        "_entries",
+        "_ttl",
+        "_max_bytes",
+        "_bytes",
+        "_generations",
+        "_writes",
+        "_unknown_writes",
+        "_lock",
+    ]
+
+    _entries: OrderedDict[Hashable, _Entry]
+    _generations: Dict[str, int]  # Writes to each table
+    _writes: int  # Every write, for results whose tables aren't known
+    _unknown_writes: int  # Writes to tables that aren't known
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self._entries = OrderedDict()
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._generations = dict()
+        self._writes = 0
+        self._unknown_writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[StaticResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry.response
+
+    # Must be read before running the query whose result will be put
+    def generation(self, tables: Optional[FrozenSet[str]]) -> Hashable:
+        with self._lock:
+            return self._generation(tables)
+
+    def _generation(self, tables: Optional[FrozenSet[str]]) -> Hashable:
+        if tables is None:
+            return self._writes
+        return (
+            self._unknown_writes,
+            tuple(self._generations.get(table, 0) for table in sorted(tables)),
+        )
+
+    def put(
+        self,
+        key: Hashable,
+        response: StaticResponse,
+        tables: Optional[FrozenSet[str]],
+        generation: Hashable,
+    ):
+        if len(response.body) > self._max_bytes:
+            return
+        with self._lock:
+            if self._generation(tables) != generation:
+                # The tables were written while the query ran
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(response, tables, time.monotonic() + self._ttl)
+            self._bytes += len(response.body)
+            # Evict the least recently used results until under the cap
+            while self._bytes > self._max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    # Drops the results that may have read from the given tables,
+    # or every result if the written tables aren't known
+    def invalidate(self, tables: Optional[FrozenSet[str]]):
+        with self._lock:
+            self._writes += 1
+            if tables is None:
+                self._unknown_writes += 1
+            else:
+                for table in tables:
+                    self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [
+                key
+                for key, entry in self._entries.items()
+                if tables is None
+                or entry.tables is None
+                or not tables.isdisjoint(entry.tables)
+            ]
+            for key in stale:
+                self._drop(key)
+
+    def _drop(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.response.body)
+
+
+_RESULT_CACHE: Optional[ResultCache] = None
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+# Returns the process' result cache, or None if caching is disabled
+def get_result_cache() -> Optional[ResultCache]:
+    global _RESULT_CACHE
+    _server = CONFIG.get().server
+    if _server.http_cache_time <= 0:
+        return None
+    if _RESULT_CACHE is None:
+        with _RESULT_CACHE_LOCK:
+            if _RESULT_CACHE is None:
+                _RESULT_CACHE = ResultCache(
+                    _server.http_cache_time, _server.result_cache_max_bytes
+                )
+    return _RESULT_CACHE
+
+
+def cache_control(private: bool) -> str:
+    return "{}, max-age={}".format(
+        "private" if private else "public", CONFIG.get().server.http_cache_time
+    )
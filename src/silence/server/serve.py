@@ -1,29 +1,53 @@
 from silence.sql import SqlOps
+from silence.db import dal
+from silence.db.rows import rows_to_structs
 from silence.server import endpoint_setup as server_endpoint
 from silence.__main__ import CONFIG
-from silence.exceptions import ServerError, ServerErrorWrapper
+from silence.config import _load_default_config
+from silence.exceptions import (
+    DatabaseError,
+    ServerError,
+    ServerErrorWrapper,
+    TokenError,
+)
+from silence.auth.tokens import check_token
 from silence.server.endpoint import (
-    RoutePattern,
-    HttpMethod,
+    CompiledTransaction,
     EndpointDefinition,
-    EndpointWithValue,
+    HttpMethod,
 )
-from silence.sql import get_sql_op
+from silence.server.static_response import StaticResponse
+from silence.server.result_cache import cache_control, get_result_cache
+from silence.server.access_log import get_access_log
+from silence.server.stats import (
+    RecordingProto,
+    RequestSample,
+    Statistics,
+    get_statistics,
+)
+from silence.sql.rewriter import QueryArgs, push_down_query_args
+from silence.logging.default_logger import logger, start_queue_logging
 
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from os.path import join
 from os import getcwd
+from pathlib import Path
+from urllib.parse import parse_qsl
 
 
 import logging
 import asyncio
+import os
 import sys
+import time
 
+from granian import Granian
+from granian.constants import Interfaces, RuntimeModes
 from granian.server.embed import Server
 from granian.rsgi import Scope
 from granian._granian import RSGIHTTPProtocol
 
-from msgspec import json
+from msgspec import Struct, json
 
 static_folder = (
     join(getcwd(), "static") if CONFIG.get().server.serve_static_files else None
@@ -32,11 +56,39 @@ static_folder = (
 (JSON_ENCODER, JSON_DECODER) = (json.Encoder(), json.Decoder())
 
 UNKNOWN_ROUTE = ServerError(404, "Unknown route.")
+UNAUTHORIZED = ServerError(401, "Unauthorized")
+UNKNOWN_ROUTE_RESPONSE = StaticResponse(
+    UNKNOWN_ROUTE.code, "text/json", JSON_ENCODER.encode(UNKNOWN_ROUTE)
+)
+
+# The summary of the API's endpoints, built on its first request as the
+# endpoints don't change after 'load_routes()'
+_SUMMARY_RESPONSE: Optional[StaticResponse] = None
+
+
+def summary_response() -> StaticResponse:
+    global _SUMMARY_RESPONSE
+    if _SUMMARY_RESPONSE is None:
+        _SUMMARY_RESPONSE = StaticResponse(
+            200,
+            "application/json",
+            JSON_ENCODER.encode(server_endpoint.ENDPOINTS._endpoints),
+        )
+    return _SUMMARY_RESPONSE
 
 
 async def app(scope: Scope, proto: RSGIHTTPProtocol):
     assert scope.proto == "http"
 
+    statistics = get_statistics()
+    if (
+        statistics is not None
+        and scope.path == STATS_PATH
+        and CONFIG.get().server.stats_endpoint
+    ):
+        send_statistics(scope, proto, statistics)
+        return
+
     route_prefix = CONFIG.get().server.api_prefix
 
     if route_prefix.endswith("/"):
@@ -47,76 +99,402 @@ async def app(scope: Scope, proto: RSGIHTTPProtocol):
         path = scope.path[len(route_prefix) :]  # Strip API prefix
         if not path.startswith("/"):
             path = "/" + path
+        sample = RequestSample()
+        access_log = get_access_log()
+        if statistics is None and access_log is None:
+            await serve_api(scope, proto, path, sample)
+            return
+        start = time.perf_counter_ns()
         try:
-            endpoint_res = server_endpoint.ENDPOINTS.find_matching_route(
-                path, HttpMethod(scope.method.casefold())
-            )
-            if endpoint_res is None:
-                raise ServerErrorWrapper(UNKNOWN_ROUTE)
+            await serve_api(scope, RecordingProto(proto, sample), path, sample)  # type: ignore
+        finally:
+            elapsed_ns = time.perf_counter_ns() - start
+            if statistics is not None:
+                statistics.record(sample, elapsed_ns)
+            if access_log is not None:
+                access_log.record(scope.method, sample, elapsed_ns)
+        return
+    UNKNOWN_ROUTE_RESPONSE.send(scope, proto)
 
-            (endpoint, param_value) = (endpoint_res.endpoint, endpoint_res.param_value)
 
-            if endpoint.query is None:
-                if (
-                    CONFIG.get().server.summary_endpoint
-                    and endpoint.route == "/"
-                    and endpoint.method == HttpMethod.GET
-                ):
-                    proto.response_str(
-                        status=200,
-                        headers=[("content-type", "text/plain")],
-                        body=JSON_ENCODER.encode(
-                            server_endpoint.ENDPOINTS._endpoints
-                        ).decode("utf-8"),
-                    )
-                    return
-                else:
-                    raise ServerErrorWrapper(UNKNOWN_ROUTE)
+# Serves a request to the API, 'sample' collects what's measured for the
+# endpoint's statistics and the access log
+async def serve_api(
+    scope: Scope, proto: RSGIHTTPProtocol, path: str, sample: RequestSample
+):
+    try:
+        endpoint_res = server_endpoint.ENDPOINTS.find_matching_route(
+            path, HttpMethod(scope.method.casefold())
+        )
+        if endpoint_res is None:
+            raise ServerErrorWrapper(UNKNOWN_ROUTE)
+
+        (name, endpoint, compiled, params) = endpoint_res
+        sample.name = name
+        sample.route = endpoint.route
 
-            match param_value:
-                case value if value is not None:
-                    # URL is parameterized
+        if compiled is None:
+            if (
+                CONFIG.get().server.summary_endpoint
+                and endpoint.route == "/"
+                and endpoint.method == HttpMethod.GET
+            ):
+                summary_response().send(scope, proto)
+                return
+            else:
+                raise ServerErrorWrapper(UNKNOWN_ROUTE)
 
-                    pass
-                case _:
-                    # URL is not parameterized
-                    pass
+        # The logged user's ID is always available to the queries, and can't
+        # be given in the URL nor in the body
+        params["loggedId"] = authenticate(scope, endpoint)
+
+        # The statements of a transaction are written as a single update
+        if isinstance(compiled, CompiledTransaction):
+            form = await read_json_object(proto)
+            for param in endpoint.request_body_params:
+                # URL params take precedence over the body ones
+                params.setdefault(param, form.get(param, None))
+            start = time.perf_counter_ns()
+            res = await dal.atransaction(
+                [(statement.sql, statement.bind) for statement in compiled.statements],
+                params,
+            )
+            sample.db_ns += time.perf_counter_ns() - start
 
-            proto.response_str(
+            result_cache = get_result_cache()
+            if result_cache is not None:
+                result_cache.invalidate(compiled.tables)
+            proto.response_bytes(
                 status=200,
-                headers=[("content-type", "text/plain")],
-                body=scope.path,
+                headers=[("content-type", "application/json")],
+                body=JSON_ENCODER.encode(res),
             )
             return
-        except Exception as e:
-            match e:
-                case ServerErrorWrapper() as error:
-                    error._error
-                    proto.response_str(
-                        status=error._error.code,
-                        headers=[("content-type", "text/json")],
-                        body=JSON_ENCODER.encode(error._error).decode("utf-8"),
+
+        # The route's parameters are the first values available to fill
+        # the query's placeholders
+        match compiled.op:
+            case SqlOps.SELECT:
+                bound_params = compiled.bind(params)
+                query_args = parse_query_string(scope.query_string)
+                threshold = CONFIG.get().server.stream_threshold_rows
+
+                # Streamed results are never cached
+                result_cache = None if endpoint.stream else get_result_cache()
+                if result_cache is not None:
+                    cache_key = (
+                        name,
+                        bound_params,
+                        tuple(sorted(query_args.items())),
                     )
-                case _:
-                    proto.response_str(
-                        status=500,
-                        headers=[("content-type", "text/json")],
-                        body=JSON_ENCODER.encode(dict({"error": e.args})).decode(
-                            "utf-8"
-                        ),
+                    cached = result_cache.get(cache_key)
+                    if cached is not None:
+                        cached.send(scope, proto)
+                        return
+                    generation = result_cache.generation(compiled.tables)
+
+                rewritten = push_down_query_args(
+                    compiled.sql,
+                    bound_params,
+                    QueryArgs(query_args),
+                    compiled.result_columns,
+                )
+                start = time.perf_counter_ns()
+                if rewritten is not None and (endpoint.stream or threshold > 0):
+                    # Only streamed once the rows are over the threshold,
+                    # otherwise they're sent (and cached) as usual
+                    buffered = await respond_rows(
+                        scope, proto, endpoint, sample, *rewritten
                     )
+                    if buffered is None:
+                        return
+                    res = buffered
+                elif rewritten is not None:
+                    res = rows_to_structs(*await dal.aquery_rows(*rewritten))
+                else:
+                    # Fall back to filtering the whole result set in Python
+                    res = server_endpoint.filter_query_results(
+                        await dal.aquery(compiled.sql, bound_params), query_args
+                    )
+                sample.db_ns += time.perf_counter_ns() - start
+                sample.rows = len(res)
+
+                if result_cache is not None:
+                    # Results that depend on the logged user aren't shared
+                    private = endpoint.required_auth or "loggedId" in compiled.params
+                    start = time.perf_counter_ns()
+                    body = JSON_ENCODER.encode(res)
+                    sample.encode_ns += time.perf_counter_ns() - start
+                    response = StaticResponse(
+                        200,
+                        "application/json",
+                        body,
+                        [("cache-control", cache_control(private))],
+                    )
+                    result_cache.put(cache_key, response, compiled.tables, generation)
+                    response.send(scope, proto)
+                    return
+            case _ if endpoint.bulk:
+                body = await proto()
+                rows = JSON_DECODER.decode(body) if body else list()
+                if not isinstance(rows, list) or not all(
+                    isinstance(row, dict) for row in rows
+                ):
+                    raise ServerErrorWrapper(
+                        ServerError(
+                            400, "The request body must be a JSON array of objects."
+                        )
+                    )
+                params_seq = list()
+                for row in rows:
+                    row_params = dict(params)
+                    for param in endpoint.request_body_params:
+                        # URL params take precedence over the body ones
+                        row_params.setdefault(param, row.get(param, None))
+                    params_seq.append(compiled.bind(row_params))
+                start = time.perf_counter_ns()
+                res = await dal.aupdate_many(
+                    compiled.sql,
+                    params_seq,
+                    CONFIG.get().server.bulk_chunk_rows,
+                    compiled.auto_id,
+                    compiled.id_param,
+                )
+                sample.db_ns += time.perf_counter_ns() - start
+
+                result_cache = get_result_cache()
+                if result_cache is not None:
+                    result_cache.invalidate(compiled.tables)
+            case _:
+                form = await read_json_object(proto)
+                for param in endpoint.request_body_params:
+                    # URL params take precedence over the body ones
+                    params.setdefault(param, form.get(param, None))
+                start = time.perf_counter_ns()
+                res = await dal.aupdate(compiled.sql, compiled.bind(params))
+                sample.db_ns += time.perf_counter_ns() - start
+
+                result_cache = get_result_cache()
+                if result_cache is not None:
+                    result_cache.invalidate(compiled.tables)
+
+        start = time.perf_counter_ns()
+        body = JSON_ENCODER.encode(res)
+        sample.encode_ns += time.perf_counter_ns() - start
+        proto.response_bytes(
+            status=200,
+            headers=[("content-type", "application/json")],
+            body=body,
+        )
+        return
+    except Exception as e:
+        match e:
+            case ServerErrorWrapper() as error if error._error is UNKNOWN_ROUTE:
+                UNKNOWN_ROUTE_RESPONSE.send(scope, proto)
+            case ServerErrorWrapper() as error:
+                proto.response_str(
+                    status=error._error.code,
+                    headers=[("content-type", "text/json")],
+                    body=JSON_ENCODER.encode(error._error).decode("utf-8"),
+                )
+            case DatabaseError() as error:
+                proto.response_str(
+                    status=500,
+                    headers=[("content-type", "text/json")],
+                    body=JSON_ENCODER.encode(ServerError(500, str(error))).decode(
+                        "utf-8"
+                    ),
+                )
+            case _:
+                proto.response_str(
+                    status=500,
+                    headers=[("content-type", "text/json")],
+                    body=JSON_ENCODER.encode(dict({"error": e.args})).decode("utf-8"),
+                )
+        return
+
+
+# Returns the logged user's ID from the request's session token, or None if
+# there's no valid token. Endpoints that require authentication reject the
+# request instead.
+def authenticate(scope: Scope, endpoint: EndpointDefinition) -> Optional[Any]:
+    token = scope.headers.get("token")
+    if token:
+        try:
+            return check_token(token).id
+        except TokenError as exc:
+            logger.debug("The user sent an invalid token: %s", str(exc))
+    if endpoint.required_auth:
+        raise ServerErrorWrapper(UNAUTHORIZED)
+    return None
+
+
+# Sends a SELECT's rows as they're read from the database, either as a chunked
+# JSON array or as NDJSON if the client accepts it. Endpoints that aren't
+# marked with 'stream' are only streamed once they exceed the row threshold,
+# otherwise nothing is sent and the rows are returned.
+async def respond_rows(
+    scope: Scope,
+    proto: RSGIHTTPProtocol,
+    endpoint: EndpointDefinition,
+    sample: RequestSample,
+    q,
+    params,
+) -> Optional[List[Struct]]:
+    threshold = CONFIG.get().server.stream_threshold_rows
+    ndjson = "application/x-ndjson" in (scope.headers.get("accept") or "")
+
+    chunks = dal.astream(q, params, CONFIG.get().server.stream_chunk_rows)
+    buffered: List[Struct] = list()
+    try:
+        if not endpoint.stream:
+            async for rows in chunks:
+                buffered.extend(rows)
+                if len(buffered) > threshold:
+                    break
+            else:
+                # The whole result fits under the threshold
+                return buffered
+
+        transport = proto.response_stream(
+            status=200,
+            headers=[
+                (
+                    "content-type",
+                    "application/x-ndjson" if ndjson else "application/json",
+                )
+            ],
+        )
+        first = True
+
+        async def send(rows: List[Struct]):
+            nonlocal first
+            sample.rows += len(rows)
+            if ndjson:
+                await transport.send_bytes(JSON_ENCODER.encode_lines(rows))
+                return
+            # Strip the array's brackets and join the chunks with commas
+            body = JSON_ENCODER.encode(rows)[1:-1]
+            await transport.send_bytes((b"[" if first else b",") + body)
+            first = False
+
+        try:
+            if buffered:
+                await send(buffered)
+            async for rows in chunks:
+                await send(rows)
+            if not ndjson:
+                await transport.send_bytes(b"]" if not first else b"[]")
+        except Exception as e:
+            # The status has already been sent, the response can only be cut short
+            logger.error("Error while streaming %s: %s", endpoint.route, e)
+    finally:
+        await chunks.aclose()
+
+
+STATS_PATH = "/_stats"
+
+
+# Sends this worker's endpoint statistics, in Prometheus' text format if
+# asked for with '?format=prometheus' or its content type
+def send_statistics(scope: Scope, proto: RSGIHTTPProtocol, statistics: Statistics):
+    if parse_query_string(scope.query_string).get(
+        "format"
+    ) == "prometheus" or "text/plain" in (scope.headers.get("accept") or ""):
         proto.response_str(
-            status=UNKNOWN_ROUTE.code,
-            headers=[("content-type", "text/json")],
-            body=JSON_ENCODER.encode(UNKNOWN_ROUTE).decode("utf-8"),
+            status=200,
+            headers=[("content-type", "text/plain; version=0.0.4")],
+            body=statistics.to_prometheus(),
+        )
+    else:
+        proto.response_bytes(
+            status=200,
+            headers=[("content-type", "application/json")],
+            body=JSON_ENCODER.encode(statistics.to_dict()),
         )
 
 
+# Reads the request's body, which must be a JSON object if there's any
+async def read_json_object(proto: RSGIHTTPProtocol) -> dict:
+    body = await proto()
+    form = JSON_DECODER.decode(body) if body else dict()
+    if not isinstance(form, dict):
+        raise ServerErrorWrapper(
+            ServerError(400, "The request body must be a JSON object.")
+        )
+    return form
+
+
+# Parses the URL query string, keeping the first value of repeated keys
+def parse_query_string(query_string: str) -> Dict[str, str]:
+    args: Dict[str, str] = dict()
+    for key, value in parse_qsl(query_string):
+        args.setdefault(key, value)
+    return args
+
+
 def server_instance():
-    return Server(app, port=CONFIG.get().server.listen_addr[1])
+    (_host, _port) = CONFIG.get().server.listen_addr
+    return Server(
+        app,
+        address=_host,
+        port=_port,
+        runtime_threads=CONFIG.get().server.threads,
+        backlog=CONFIG.get().server.backlog,
+    )
+
+
+# Lets spawned workers know whether the debug mode is enabled
+_DEBUG_ENV = "SILENCE_DEBUG"
+
+
+# Entry point of every worker process when running with several workers.
+# Workers may be spawned (a fresh interpreter) or forked (a copy of the
+# parent), in which case the config and the endpoints are already loaded.
+def worker_app():
+    from silence.server import endpoint_parser
+
+    if os.environ.get(_DEBUG_ENV) == "1" and not CONFIG.debug:
+        CONFIG.toggle_debug()
+        logger.setLevel(logging.DEBUG)
+        for handler in logger.handlers:
+            handler.setLevel(logging.DEBUG)
+    if CONFIG.get() == _load_default_config():
+        CONFIG.load_config()
+        start_queue_logging()
+    if not server_endpoint.ENDPOINTS._endpoints:
+        endpoint_parser.load_routes(dump_auto_endpoints=False)
+    return app
 
 
 def serve():
+    _server = CONFIG.get().server
+
+    if _server.workers > 1:
+        os.environ[_DEBUG_ENV] = "1" if CONFIG.debug else "0"
+        Granian(
+            "silence.server.serve:worker_app",
+            address=_server.listen_addr[0],
+            port=_server.listen_addr[1],
+            interface=Interfaces.RSGI,
+            workers=_server.workers,
+            runtime_threads=_server.threads,
+            runtime_mode=RuntimeModes(_server.runtime_mode),
+            backlog=_server.backlog,
+            factory=True,
+            working_dir=Path(getcwd()),
+        ).serve()
+        return
+
+    # The embedded server runs in this process' event loop, with no choice of
+    # runtime mode
+    if _server.runtime_mode != "auto":
+        logger.warning(
+            "'runtime_mode' = '%s' has no effect with a single worker, "
+            "it only applies when 'workers' is greater than 1",
+            _server.runtime_mode,
+        )
+
     event_loop = asyncio.new_event_loop()
 
     server_task = event_loop.create_task(server_instance().serve())
@@ -0,0 +1,56 @@
+from typing import List, Sequence, Tuple
+
+import hashlib
+
+from granian.rsgi import Scope
+from granian._granian import RSGIHTTPProtocol
+
+#
+# Responses whose body never changes once the routes have been loaded are
+# encoded a single time, along with their headers and ETag, and sent as is.
+# Clients that already have the body get a 304 without it, for the GET and
+# HEAD requests that succeed.
+#########################################################################
+
+
+class StaticResponse:
+    __slots__ = ["status", "body", "etag", "headers", "not_modified_headers"]
+
+    status: int
+    body: bytes
+    etag: str
+    headers: List[Tuple[str, str]]
+    not_modified_headers: List[Tuple[str, str]]
+
+    def __init__(
+        self,
+        status: int,
+        content_type: str,
+        body: bytes,
+        extra_headers: Sequence[Tuple[str, str]] = (),
+    ):
+        self.status = status
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+        self.not_modified_headers = [("etag", self.etag), *extra_headers]
+        self.headers = [
+            ("content-type", content_type),
+            ("content-length", str(len(body))),
+            *self.not_modified_headers,
+        ]
+
+    def send(self, scope: Scope, proto: RSGIHTTPProtocol):
+        if self.is_not_modified(scope):
+            proto.response_empty(status=304, headers=self.not_modified_headers)
+        else:
+            proto.response_bytes(
+                status=self.status, headers=self.headers, body=self.body
+            )
+
+    def is_not_modified(self, scope: Scope) -> bool:
+        if self.status != 200 or scope.method not in ("GET", "HEAD"):
+            return False
+        if_none_match = scope.headers.get("if-none-match")
+        return if_none_match is not None and (
+            self.etag in if_none_match or if_none_match.strip() == "*"
+        )
@@ -0,0 +1,305 @@
+from silence.__main__ import CONFIG
+from silence.auth.passwords import pending as pending_password_hashes
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import threading
+import time
+
+from granian._granian import RSGIHTTPProtocol
+
+#
+# Per endpoint statistics of the requests served by this worker: counters
+# and latency histograms with a fixed relative error (in the manner of HDR
+# histograms), so recording a request is a few integer operations and
+# percentiles can be read at any time. Collected when
+# 'General.endpoint_statistics' is enabled, and exposed at '/_stats' as JSON
+# or in Prometheus' text format when 'Server.stats_endpoint' is too.
+#########################################################################
+
+# Each power of two is split in 2^_SUB_BITS buckets, ~6% of relative error
+_SUB_BITS = 4
+_SUB_BUCKETS = 1 << _SUB_BITS
+# Up to 2^36 µs (~19 hours), longer latencies fall in the last bucket
+_BUCKETS = (36 - _SUB_BITS + 1) * _SUB_BUCKETS
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    __slots__ = ["counts", "count", "total_us"]
+
+    counts: List[int]
+    count: int
+    total_us: int
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total_us = 0
+
+    def record(self, us: int):
+        if us < _SUB_BUCKETS:
+            i = max(us, 0)
+        else:
+            shift = us.bit_length() - _SUB_BITS - 1
+            i = min(
+                (shift + 1) * _SUB_BUCKETS + (us >> shift) - _SUB_BUCKETS, _BUCKETS - 1
+            )
+        self.counts[i] += 1
+        self.count += 1
+        self.total_us += us
+
+    # Returns the value at the given quantile, in microseconds
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return _bucket_middle(i)
+        return _bucket_middle(_BUCKETS - 1)
+
+
+def _bucket_middle(i: int) -> float:
+    if i < _SUB_BUCKETS:
+        return float(i)
+    shift = i // _SUB_BUCKETS - 1
+    low = (i % _SUB_BUCKETS + _SUB_BUCKETS) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+class EndpointStats:
+    __slots__ = ["requests", "errors", "rows", "bytes_sent", "total", "db", "encode"]
+
+    requests: int
+    errors: int  # Responses with a status of 400 or more
+    rows: int
+    bytes_sent: int
+    total: LatencyHistogram
+    db: LatencyHistogram  # Time spent waiting for the database
+    encode: LatencyHistogram  # Time spent encoding the results
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes_sent = 0
+        self.total = LatencyHistogram()
+        self.db = LatencyHistogram()
+        self.encode = LatencyHistogram()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rows": self.rows,
+            "bytesSent": self.bytes_sent,
+            **{
+                name: {
+                    "p{}".format(round(q * 100)): round(histogram.quantile(q) / 1000, 3)
+                    for q in QUANTILES
+                }
+                | {"totalMs": round(histogram.total_us / 1000, 3)}
+                for name, histogram in (
+                    ("latencyMs", self.total),
+                    ("dbMs", self.db),
+                    ("encodeMs", self.encode),
+                )
+            },
+        }
+
+
+"""
+What is measured while serving a request, recorded once it has been sent.
+"""
+
+
+class RequestSample:
+    __slots__ = ["name", "route", "status", "db_ns", "encode_ns", "rows", "bytes_sent"]
+
+    name: Optional[str]  # The endpoint's name, if the route matched one
+    route: Optional[str]  # The endpoint's route template
+    status: int
+    db_ns: int
+    encode_ns: int
+    rows: int
+    bytes_sent: int
+
+    def __init__(self):
+        self.name = None
+        self.route = None
+        self.status = 0
+        self.db_ns = 0
+        self.encode_ns = 0
+        self.rows = 0
+        self.bytes_sent = 0
+
+
+class Statistics:
+    __slots__ = ["_endpoints", "_started_at", "_lock"]
+
+    _endpoints: Dict[str, EndpointStats]
+
+    def __init__(self):
+        self._endpoints = dict()
+        self._started_at = time.time()
+        # The worker's runtime threads record requests concurrently, and
+        # without the GIL the counters' increments aren't atomic
+        self._lock = threading.Lock()
+
+    def record(self, sample: RequestSample, elapsed_ns: int):
+        name = sample.name or "_unknown_route"
+        with self._lock:
+            stats = self._endpoints.get(name)
+            if stats is None:
+                stats = self._endpoints[name] = EndpointStats()
+            stats.requests += 1
+            if sample.status >= 400:
+                stats.errors += 1
+            stats.rows += sample.rows
+            stats.bytes_sent += sample.bytes_sent
+            stats.total.record(elapsed_ns // 1000)
+            stats.db.record(sample.db_ns // 1000)
+            stats.encode.record(sample.encode_ns // 1000)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "since": self._started_at,
+                "passwordHashesPending": pending_password_hashes(),
+                "endpoints": {
+                    name: stats.to_dict()
+                    for name, stats in sorted(self._endpoints.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            return self._to_prometheus()
+
+    def _to_prometheus(self) -> str:
+        lines: List[str] = list()
+        counters: Tuple[Tuple[str, str, str], ...] = (
+            ("requests", "requests_total", "Requests served"),
+            ("errors", "errors_total", "Responses with an error status"),
+            ("rows", "rows_total", "Rows returned"),
+            ("bytes_sent", "sent_bytes_total", "Bytes of the responses' bodies"),
+        )
+        for attr, metric, description in counters:
+            lines.append("# HELP silence_endpoint_{} {}".format(metric, description))
+            lines.append("# TYPE silence_endpoint_{} counter".format(metric))
+            for name, stats in self._endpoints.items():
+                lines.append(
+                    'silence_endpoint_{}{{endpoint="{}"}} {}'.format(
+                        metric, name, getattr(stats, attr)
+                    )
+                )
+        summaries = (
+            ("total", "latency_seconds", "Time to serve a request"),
+            ("db", "db_seconds", "Time spent waiting for the database"),
+            ("encode", "encode_seconds", "Time spent encoding the results"),
+        )
+        for attr, metric, description in summaries:
+            lines.append("# HELP silence_endpoint_{} {}".format(metric, description))
+            lines.append("# TYPE silence_endpoint_{} summary".format(metric))
+            for name, stats in self._endpoints.items():
+                histogram: LatencyHistogram = getattr(stats, attr)
+                for q in QUANTILES:
+                    lines.append(
+                        'silence_endpoint_{}{{endpoint="{}",quantile="{}"}} {}'.format(
+                            metric, name, q, histogram.quantile(q) / 1e6
+                        )
+                    )
+                lines.append(
+                    'silence_endpoint_{}_sum{{endpoint="{}"}} {}'.format(
+                        metric, name, histogram.total_us / 1e6
+                    )
+                )
+                lines.append(
+                    'silence_endpoint_{}_count{{endpoint="{}"}} {}'.format(
+                        metric, name, histogram.count
+                    )
+                )
+        lines.append(
+            "# HELP silence_password_hashes_pending "
+            "Password hashes and checks queued or running"
+        )
+        lines.append("# TYPE silence_password_hashes_pending gauge")
+        lines.append(
+            "silence_password_hashes_pending {}".format(pending_password_hashes())
+        )
+        return "\n".join(lines) + "\n"
+
+
+_STATISTICS: Optional[Statistics] = None
+_STATISTICS_LOCK = threading.Lock()
+
+
+# Returns the process' statistics, or None if they're disabled
+def get_statistics() -> Optional[Statistics]:
+    global _STATISTICS
+    if not CONFIG.get().general.endpoint_statistics:
+        return None
+    if _STATISTICS is None:
+        with _STATISTICS_LOCK:
+            if _STATISTICS is None:
+                _STATISTICS = Statistics()
+    return _STATISTICS
+
+
+"""
+Wraps the RSGI protocol of a request to capture the response's status and
+the bytes sent, whichever way the response is sent.
+"""
+
+
+class RecordingProto:
+    __slots__ = ["_proto", "_sample"]
+
+    def __init__(self, proto: RSGIHTTPProtocol, sample: RequestSample):
+        self._proto = proto
+        self._sample = sample
+
+    def __call__(self):
+        return self._proto()
+
+    def response_empty(self, status: int, headers):
+        self._sample.status = status
+        self._proto.response_empty(status=status, headers=headers)
+
+    def response_bytes(self, status: int, headers, body: bytes):
+        self._sample.status = status
+        self._sample.bytes_sent += len(body)
+        self._proto.response_bytes(status=status, headers=headers, body=body)
+
+    def response_str(self, status: int, headers, body: str):
+        self._sample.status = status
+        # Sent as UTF-8, a character may take several bytes
+        self._sample.bytes_sent += len(body.encode())
+        self._proto.response_str(status=status, headers=headers, body=body)
+
+    def response_stream(self, status: int, headers):
+        self._sample.status = status
+        return _RecordingTransport(
+            self._proto.response_stream(status=status, headers=headers), self._sample
+        )
+
+
+class _RecordingTransport:
+    __slots__ = ["_transport", "_sample"]
+
+    def __init__(self, transport, sample: RequestSample):
+        self._transport = transport
+        self._sample = sample
+
+    async def send_bytes(self, data: bytes):
+        self._sample.bytes_sent += len(data)
+        await self._transport.send_bytes(data)
+
+    async def send_str(self, data: str):
+        # Sent as UTF-8, a character may take several bytes
+        self._sample.bytes_sent += len(data.encode())
+        await self._transport.send_str(data)
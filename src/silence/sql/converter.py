@@ -1,5 +1,14 @@
 import re
 
+from typing import List
+
 
 def silence_to_mysql(sql):
     return re.sub(r"\$\w+", "%s", sql)
+
+
+# Returns a list of $params in a SQL query or endpoint route,
+# without the $'s
+def extract_params(string) -> List[str]:
+    res = re.findall(r"\$\w+", string)
+    return [x[1:] for x in res]
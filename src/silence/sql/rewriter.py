@@ -0,0 +1,129 @@
+from silence.sql.tables import DATABASE_SCHEMA
+
+from typing import Any, FrozenSet, List, Mapping, Optional, Tuple
+
+import re
+
+#
+# Pushes the query string's filtering (?col=value), ordering (_sort, _order)
+# and paging (_limit, _page) down into the endpoint's SELECT, so that only
+# the requested rows leave the database. The clauses are appended to the
+# query itself, so only 'SELECT * FROM <table> [WHERE ...]' queries are
+# rewritten: wrapping others in a derived table breaks joins with repeated
+# column names and loses their ORDER BY on MariaDB.
+#########################################################################
+
+# Only 'SELECT * FROM <table> ...' queries have a result set whose columns
+# are known from the schema
+RE_SELECT_ALL = re.compile(
+    r"^\s*SELECT\s+\*\s+FROM\s+`?(\w+)`?(?P<rest>.*?);?\s*$", re.I | re.S
+)
+RE_MULTI_TABLE = re.compile(r"\b(JOIN|UNION)\b|,", re.I)
+# Anything but a WHERE clause after the table, or a subquery that may have it
+RE_NOT_APPENDABLE = re.compile(
+    r"\b(GROUP|HAVING|ORDER|LIMIT|WINDOW|UNION|JOIN|FOR|INTO|LOCK|PROCEDURE|SELECT)\b",
+    re.I,
+)
+RE_WHERE = re.compile(r"^\s*WHERE\b(?P<condition>.*)$", re.I | re.S)
+
+
+class QueryArgs:
+    __slots__ = ["filters", "sort", "descending", "limit", "page"]
+
+    filters: List[Tuple[str, str]]
+    sort: Optional[str]
+    descending: bool
+    limit: Optional[int]
+    page: Optional[int]
+
+    def __init__(self, args: Mapping[str, str]):
+        self.sort = args.get("_sort")
+        self.descending = args.get("_order") == "desc"
+        self.limit = _parse_int(args.get("_limit"))
+        self.page = _parse_int(args.get("_page"))
+        self.filters = [pair for pair in args.items() if not pair[0].startswith("_")]
+
+    def is_empty(self) -> bool:
+        return not self.filters and not self.sort and not self.limit
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)  # type: ignore
+    except (ValueError, TypeError):
+        return None
+
+
+# Returns the columns of a query's result set, or None if they can't be known
+def get_result_columns(sql: str) -> Optional[FrozenSet[str]]:
+    m = RE_SELECT_ALL.match(sql)
+    if m is None or RE_MULTI_TABLE.search(m.group("rest")):
+        return None
+    table = DATABASE_SCHEMA.get_table(m.group(1))
+    if table is None:
+        return None
+    return frozenset(field.name for field in table.fields)
+
+
+# Returns the rewritten query and its parameters, or None if the query string
+# can't be expressed in SQL and the results must be filtered in Python
+def push_down_query_args(
+    sql: str,
+    params: Tuple[Any, ...],
+    args: QueryArgs,
+    columns: Optional[FrozenSet[str]],
+) -> Optional[Tuple[str, Tuple[Any, ...]]]:
+    if args.is_empty():
+        return (sql, params)
+
+    # Negative values have a different meaning when slicing a list
+    if (args.limit is not None and args.limit < 0) or (
+        args.page is not None and args.page < 0
+    ):
+        return None
+
+    # The query must be a single table whose result's columns are known (as
+    # filtering and sorting by unknown columns are ignored, like the Python
+    # fallback does), and nothing but a WHERE clause can follow the table
+    m = RE_SELECT_ALL.match(sql)
+    if m is None or columns is None:
+        return None
+    rest = m.group("rest").strip()
+    if RE_MULTI_TABLE.search(rest) or RE_NOT_APPENDABLE.search(rest):
+        return None
+    where = RE_WHERE.match(rest) if rest else None
+    if rest and where is None:
+        return None
+
+    head = sql.strip().rstrip(";").rstrip()
+    condition = None
+    if where is not None:
+        # The table's own WHERE becomes part of the new one
+        head = sql[: m.start("rest")].rstrip()
+        condition = where.group("condition").strip()
+    clauses: List[str] = list()
+    extra: List[Any] = list()
+
+    filters = [(k, v) for k, v in args.filters if k in columns]
+    extra.extend(v for _, v in filters)
+
+    if args.sort and args.sort in columns:
+        clauses.append(
+            "ORDER BY `{}` {}".format(args.sort, "DESC" if args.descending else "ASC")
+        )
+
+    if args.limit:
+        clauses.append("LIMIT %s OFFSET %s")
+        extra.extend((args.limit, args.limit * args.page if args.page else 0))
+
+    if not filters and not clauses:
+        return (sql, params)
+    if not params and extra:
+        # Literal '%' must be escaped once the query has placeholders
+        head = head.replace("%", "%%")
+        condition = condition.replace("%", "%%") if condition else condition
+    conditions = ["({})".format(condition)] if condition else []
+    conditions.extend("`{}` = %s".format(k) for k, _ in filters)
+    if conditions:
+        clauses.insert(0, "WHERE " + " AND ".join(conditions))
+    return (" ".join([head, *clauses]), params + tuple(extra))
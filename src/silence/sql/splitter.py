@@ -0,0 +1,186 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern
+
+import re
+
+#
+# Splits SQL scripts into statements as they're read, without holding the
+# whole script in memory. Delimiters inside quoted strings, identifiers and
+# comments are ignored, and the client-side DELIMITER command is emulated.
+# Comments are dropped, except the executable ones ('/*! ... */', '/*+ ... */').
+# Plain text and complete quoted strings are skipped by a single regular
+# expression, so Python code only runs at delimiters and comments.
+#########################################################################
+
+RE_QUOTED: Dict[str, Pattern] = {
+    "'": re.compile(r"'(?:[^'\\]|\\.|'')*'", re.S),
+    '"': re.compile(r'"(?:[^"\\]|\\.|"")*"', re.S),
+    "`": re.compile(r"`(?:[^`]|``)*`"),
+}
+RE_DELIMITER_COMMAND = re.compile(r"DELIMITER[ \t]+(\S+)[^\n]*(\n|\Z)", re.I)
+RE_WHITESPACE = re.compile(r"\s*")
+_DELIMITER_KEYWORD = "delimiter "
+
+
+def _token_regex(delimiter: str) -> Pattern:
+    return re.compile(re.escape(delimiter) + r"|['\"`#]|--(?=\s)|--\Z|/\*")
+
+
+# Matches text without delimiters or comments. An escaped quote ('') is read
+# as two strings, which doesn't change where the statement ends.
+def _skip_regex(delimiter: str) -> Pattern:
+    return re.compile(
+        r"(?:(?!" + re.escape(delimiter) + r")"
+        r"(?:[^'\"`#/\-" + re.escape(delimiter[0]) + r"]+"
+        r"|'(?:[^'\\]|\\.)*'"
+        r'|"(?:[^"\\]|\\.)*"'
+        r"|`[^`]*`"
+        r"|/(?!\*)"
+        r"|-(?!-(?:\s|\Z))"
+        r"|" + re.escape(delimiter[0]) + r"))*+",
+        re.S,
+    )
+
+
+# Length of the end of the text that may be the start of a token
+def _partial_token_len(text: str, delimiter: str) -> int:
+    for k in range(min(max(len(delimiter) - 1, 1), len(text)), 0, -1):
+        tail = text[-k:]
+        if delimiter.startswith(tail) or tail in ("-", "/"):
+            return k
+    return 0
+
+
+class SqlSplitter:
+    __slots__ = ["delimiter", "_token", "_skip", "_buf", "_parts", "_empty"]
+
+    delimiter: str
+    _token: Pattern
+    _skip: Pattern
+    _buf: str  # Text that couldn't be scanned yet
+    _parts: List[str]  # Scanned text of the current statement
+    _empty: bool  # Whether the current statement has no text yet
+
+    def __init__(self, delimiter: str = ";"):
+        self.delimiter = delimiter
+        self._token = _token_regex(delimiter)
+        self._skip = _skip_regex(delimiter)
+        self._buf = ""
+        self._parts = list()
+        self._empty = True
+
+    # Returns the statements completed by the given text
+    def feed(self, text: str) -> List[str]:
+        self._buf += text
+        return list(self._scan(final=False))
+
+    # Returns the remaining statements, including the last one even if it
+    # wasn't terminated
+    def close(self) -> List[str]:
+        statements = list(self._scan(final=True))
+        statement = "".join(self._parts).strip()
+        self._parts = list()
+        self._empty = True
+        if statement:
+            statements.append(statement)
+        return statements
+
+    def _scan(self, final: bool) -> Iterator[str]:
+        buf = self._buf
+        pos = seg = 0  # Scanned up to 'pos', the statement's text since 'seg'
+        while True:
+            if self._empty:
+                start = RE_WHITESPACE.match(buf, pos).end()  # type: ignore
+                rest = buf[start : start + len(_DELIMITER_KEYWORD)].lower()
+                if not final and _DELIMITER_KEYWORD.startswith(rest):
+                    # Can't tell yet whether it's a DELIMITER command
+                    pos = start
+                    break
+                m = RE_DELIMITER_COMMAND.match(buf, start)
+                if m is not None:
+                    if not m.group(2) and not final:
+                        pos = start
+                        break
+                    self.delimiter = m.group(1)
+                    self._token = _token_regex(self.delimiter)
+                    self._skip = _skip_regex(self.delimiter)
+                    pos = seg = m.end()
+                    continue
+
+            skipped = self._skip.match(buf, pos).end()  # type: ignore
+            if self._empty and buf[pos:skipped].strip():
+                self._empty = False
+
+            t = self._token.match(buf, skipped)
+            if t is None:
+                # Only plain text is left, but a token may be split between
+                # this text and the next one
+                if not final:
+                    skipped -= _partial_token_len(buf[pos:skipped], self.delimiter)
+                pos = skipped
+                break
+            pos = skipped
+            token = t.group()
+
+            if token == self.delimiter:
+                self._parts.append(buf[seg : t.start()])
+                statement = "".join(self._parts).strip()
+                self._parts = list()
+                self._empty = True
+                pos = seg = t.end()
+                if statement:
+                    yield statement
+            elif token in RE_QUOTED:
+                m = RE_QUOTED[token].match(buf, t.start())
+                if m is None or (m.end() == len(buf) and not final):
+                    # The closing quote hasn't been read yet (or it may be
+                    # the first one of an escaped '')
+                    if not final:
+                        pos = t.start()
+                        break
+                    pos = len(buf)
+                else:
+                    pos = m.end()
+                self._empty = False
+            elif token.startswith(("--", "#")):
+                if token == "--" and t.end() == len(buf) and not final:
+                    pos = t.start()
+                    break
+                end = buf.find("\n", t.end())
+                if end < 0:
+                    if not final:
+                        pos = t.start()
+                        break
+                    end = len(buf)
+                self._parts.append(buf[seg : t.start()])
+                pos = seg = end
+            else:  # /* ... */
+                end = buf.find("*/", t.end())
+                if end < 0:
+                    if not final:
+                        pos = t.start()
+                        break
+                    end = len(buf) - 2
+                if buf.startswith(("/*!", "/*+"), t.start()):
+                    pos = end + 2
+                    self._empty = False
+                else:
+                    self._parts.append(buf[seg : t.start()])
+                    self._parts.append(" ")
+                    pos = seg = end + 2
+
+        self._parts.append(buf[seg:pos])
+        self._buf = buf[pos:]
+
+
+# Yields the statements of a script read in chunks of text
+def split_statements(chunks: Iterable[str], delimiter: str = ";") -> Iterator[str]:
+    splitter = SqlSplitter(delimiter)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+
+# Returns the statement's first keyword, lowercased
+def first_keyword(statement: str) -> Optional[str]:
+    m = re.match(r"\s*(\w+)", statement)
+    return m.group(1).lower() if m is not None else None
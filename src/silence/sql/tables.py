@@ -1,25 +1,50 @@
-from silence.db.dal import query
+from silence.__main__ import CONFIG
+from silence.db.dal import query_rows
 from silence.logging.default_logger import logger
+from silence.logging.truncated import Truncated
 
-from typing import List, Optional, Tuple
+from typing import ClassVar, Dict, FrozenSet, List, Optional, Tuple
+from itertools import groupby
+from os import makedirs, path, replace, unlink
 
-from msgspec import Struct, field
+import re
+import tempfile
+
+from msgspec import Struct, field, msgpack, MsgspecError
+
+RE_IDENTIFIER = re.compile(r"\w+")
 
 
 class TableField(Struct, frozen=True, gc=False, forbid_unknown_fields=True):
     name: str
     auto_increment: Optional[bool]
+    """The column's full type, e.g. 'varchar(64)' or 'int unsigned'"""
+    type: str = field(default="")
+    nullable: bool = field(default=True)
+    """The column's default value as reported by the database, if any"""
+    default: Optional[str] = field(default=None)
+    """Whether the column alone is a primary or unique key"""
+    unique: bool = field(default=False)
 
 
 class TableSchema(Struct, frozen=True, gc=False, forbid_unknown_fields=True):
     name: str
     fields: List[TableField]
+    """The first column of the primary key, or an empty string if there's none"""
     primary_key_field: str
     is_view: bool
+    """Every column of the primary key, in the key's order"""
+    primary_key_fields: List[str] = field(default_factory=list)
 
 
 class DatabaseSchema(Struct, gc=False, forbid_unknown_fields=True):
     tables: List[TableSchema] = field(default_factory=list)
+    """Tables by their casefolded name, built along with 'tables'"""
+    tables_index: Dict[str, TableSchema] = field(default_factory=dict)
+    """Columns by their table's and their own casefolded names"""
+    fields_index: Dict[Tuple[str, str], TableField] = field(default_factory=dict)
+    """The casefolded names of the views"""
+    views: FrozenSet[str] = field(default_factory=frozenset)
 
     @staticmethod
     def new_from_db():
@@ -28,45 +53,208 @@ class DatabaseSchema(Struct, gc=False, forbid_unknown_fields=True):
         return db_schema
 
     """
-    This method is only valid when the 'Self.table' field hasn't been
-    modified after it's initial load
+    These methods are only valid when the 'Self.table' field hasn't been
+    modified after it's initial load. Names are case insensitive.
     """
 
     def get_table(self, table_name: str) -> Optional[TableSchema]:
-        return next(
-            (table for table in DATABASE_SCHEMA.tables if table.name == table_name),
-            None,
+        return self.tables_index.get(table_name.casefold())
+
+    def get_field(self, table_name: str, field_name: str) -> Optional[TableField]:
+        return self.fields_index.get((table_name.casefold(), field_name.casefold()))
+
+    # Returns the casefolded names of the tables a query mentions, or None if
+    # they can't be known (no schema loaded, views or no known table at all).
+    # Any identifier that matches a table counts, which can only overestimate.
+    def referenced_tables(self, sql: str) -> Optional[FrozenSet[str]]:
+        if len(self.tables) == 0:
+            return None
+        tables = frozenset(
+            word
+            for word in (word.casefold() for word in RE_IDENTIFIER.findall(sql))
+            if word in self.tables_index
+        )
+        if not tables or not self.views.isdisjoint(tables):
+            return None
+        return tables
+
+    # Builds the lookup indexes, once the tables have been loaded
+    def _build_indexes(self):
+        for table in self.tables:
+            table_name = table.name.casefold()
+            self.tables_index.setdefault(table_name, table)
+            for table_field in table.fields:
+                self.fields_index.setdefault(
+                    (table_name, table_field.name.casefold()), table_field
+                )
+        self.views = frozenset(
+            table.name.casefold() for table in self.tables if table.is_view
         )
 
+    """
+    Loads the tables from the snapshot at 'snapshot_path' if the database's
+    fingerprint still matches it, otherwise introspects the database and
+    writes a new snapshot. Returns whether the snapshot was used.
+    """
+
+    def load_tables_cached(self, snapshot_path: str) -> bool:
+        _conn = CONFIG.get().db_conn
+        database = "{}:{}/{}".format(_conn.host[0], _conn.host[1], _conn.db)
+        (_, rows) = query_rows(FINGERPRINT_QUERY)
+        fingerprint = "|".join(str(x) for x in rows[0])
+
+        try:
+            with open(snapshot_path, "rb") as f:
+                snapshot = msgpack.decode(f.read(), type=SchemaSnapshot)
+            if (
+                snapshot.version == SchemaSnapshot.VERSION
+                and snapshot.database == database
+                and snapshot.fingerprint == fingerprint
+            ):
+                if len(self.tables) != 0:
+                    raise Exception(
+                        "Cannot overwrite already loaded database's schema on runtime!"
+                    )
+                self.tables.extend(snapshot.tables)
+                self._build_indexes()
+                logger.debug("Loaded the database's schema from %s", snapshot_path)
+                return True
+            logger.debug("The schema snapshot is outdated, introspecting the database")
+        except (OSError, MsgspecError) as e:
+            logger.debug("Cannot read the schema snapshot (%s)", e)
+
+        self.load_tables()
+        try:
+            makedirs(path.dirname(snapshot_path), exist_ok=True)
+            data = msgpack.encode(
+                SchemaSnapshot(
+                    SchemaSnapshot.VERSION, database, fingerprint, self.tables
+                )
+            )
+            # Each worker writes its own file, the last one replaced wins
+            with tempfile.NamedTemporaryFile(
+                dir=path.dirname(snapshot_path),
+                prefix=path.basename(snapshot_path) + ".",
+                suffix=".tmp",
+                delete=False,
+            ) as f:
+                tmp_path = f.name
+                try:
+                    f.write(data)
+                except OSError:
+                    f.close()
+                    unlink(tmp_path)
+                    raise
+            replace(tmp_path, snapshot_path)
+        except OSError as e:
+            logger.warning("Cannot write the schema snapshot: %s", e)
+        return False
+
     def load_tables(self):
         if len(self.tables) != 0:
             raise Exception(
-                "Cannot overwrite alrady loaded database's schema on runtime!"
+                "Cannot overwrite already loaded database's schema on runtime!"
+            )
+        (_, rows) = query_rows(INTROSPECTION_QUERY)
+        # The rows come sorted by table and then by column position
+        for table_name, table_rows in groupby(rows, key=lambda row: row[0]):
+            table_rows = list(table_rows)
+            primary_key = sorted(
+                (row for row in table_rows if row[7] is not None),
+                key=lambda row: row[7],
             )
-        res = query(q="SHOW FULL TABLES;")
-        for table_data in res:
-            (table_name, table_type) = [x for x in table_data.values()]
-            (primary_key_field, fields) = self._get_table_fields(table_name)
+            primary_key_fields = [row[2] for row in primary_key]
             self.tables.append(
-                TableSchema(table_name, fields, primary_key_field, table_type == "VIEW")
+                TableSchema(
+                    table_name,
+                    [
+                        TableField(
+                            name=row[2],
+                            auto_increment="auto_increment" in (row[6] or "").lower(),
+                            type=row[3],
+                            nullable=row[4] == "YES",
+                            default=row[5],
+                            unique=bool(row[8]),
+                        )
+                        for row in table_rows
+                    ],
+                    primary_key_fields[0] if primary_key_fields else "",
+                    table_rows[0][1] == "VIEW",
+                    primary_key_fields,
+                )
             )
+        self._build_indexes()
         logger.debug(
             "Tables in the database: %s",
-            self.tables,
+            Truncated(self.tables),
         )
 
-    # Returns the table's primary key and all the table's fields
-    @staticmethod
-    def _get_table_fields(table_name) -> Tuple[str, List[TableField]]:
-        fields: List[TableField] = list()
-        primary_key_field: str = str()
-        for _field in query(f"SHOW COLUMNS FROM {table_name}"):
-            if primary_key_field == "" and _field["Key"] == "PRI":
-                primary_key_field = _field["Field"]
-            fields.append(
-                TableField(_field["Field"], _field["Extra"] == "auto_increment")
-            )
-        return (primary_key_field, fields)
+
+# The whole schema (tables, columns and primary keys) in a single query
+INTROSPECTION_QUERY = """
+SELECT
+    t.TABLE_NAME AS table_name,
+    t.TABLE_TYPE AS table_type,
+    c.COLUMN_NAME AS column_name,
+    c.COLUMN_TYPE AS column_type,
+    c.IS_NULLABLE AS is_nullable,
+    c.COLUMN_DEFAULT AS column_default,
+    c.EXTRA AS extra,
+    k.ORDINAL_POSITION AS pk_position,
+    u.COLUMN_NAME IS NOT NULL AS is_unique
+FROM information_schema.TABLES t
+JOIN information_schema.COLUMNS c
+    ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+LEFT JOIN information_schema.KEY_COLUMN_USAGE k
+    ON k.TABLE_SCHEMA = c.TABLE_SCHEMA
+    AND k.TABLE_NAME = c.TABLE_NAME
+    AND k.COLUMN_NAME = c.COLUMN_NAME
+    AND k.CONSTRAINT_NAME = 'PRIMARY'
+LEFT JOIN (
+    -- Columns that are unique by themselves, i.e. have a single column
+    -- primary or unique key
+    SELECT DISTINCT TABLE_NAME, COLUMN_NAME FROM (
+        SELECT TABLE_NAME, MIN(COLUMN_NAME) AS COLUMN_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND NON_UNIQUE = 0
+        GROUP BY TABLE_NAME, INDEX_NAME
+        HAVING COUNT(*) = 1
+    ) single_column_keys
+) u
+    ON u.TABLE_NAME = c.TABLE_NAME AND u.COLUMN_NAME = c.COLUMN_NAME
+WHERE t.TABLE_SCHEMA = DATABASE()
+ORDER BY t.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+
+# A cheap summary of the schema: the number of tables, columns and indexed
+# columns and the sums of their definitions' checksums, which change with
+# any DDL statement
+FINGERPRINT_QUERY = """
+SELECT
+    (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('|',
+        TABLE_NAME, TABLE_TYPE, CREATE_TIME))), 0))
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = DATABASE()) AS tables_fingerprint,
+    (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('|',
+        TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE, IS_NULLABLE,
+        COLUMN_DEFAULT, EXTRA, COLUMN_KEY))), 0))
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()) AS columns_fingerprint,
+    (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('|',
+        TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME, NON_UNIQUE))), 0))
+    FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()) AS indexes_fingerprint
+"""
+
+
+class SchemaSnapshot(Struct, frozen=True, gc=False):
+    VERSION: ClassVar[int] = 2
+
+    version: int
+    database: str  # host:port/db, so that snapshots aren't mixed up
+    fingerprint: str
+    tables: List[TableSchema]
 
 
 DATABASE_SCHEMA = DatabaseSchema()